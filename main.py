@@ -7,6 +7,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from routers import channels, dashboards, root
+from shared_resources.catalog_snapshot import load_catalog_snapshot
 from shared_resources.datahub_synchronizer import backend_synchronizer
 from shared_resources.mongo_service import (
     check_mongo_connected,
@@ -27,6 +28,12 @@ async def lifespan(app: FastAPI):
     # Make sure we have important indices
     configure_mongo_indices(app.state.shared)
 
+    # Serve channel searches from the last persisted catalog until the synchronizer has refreshed it
+    channel_catalog = load_catalog_snapshot(app.state.shared)
+    if channel_catalog is not None:
+        with app.state.shared.channel_catalog_lock:
+            app.state.shared.channel_catalog = channel_catalog
+
     # Start the backend synchronizer in a separate thread
     backend_channel_thread = Thread(target=backend_synchronizer, args=(app.state.shared,))
     backend_channel_thread.daemon = True
@@ -38,6 +45,8 @@ async def lifespan(app: FastAPI):
 
     # Stop backend synchronizer
     app.state._backend_channel_thread.join(0)
+    app.state.shared.raw_segment_executor.shutdown(wait=False, cancel_futures=True)
+    app.state.shared.curve_batch_executor.shutdown(wait=False, cancel_futures=True)
     app.state.shared.mongo_client.close()
 
 
@@ -54,6 +63,7 @@ app = FastAPI(lifespan=lifespan, openapi_tags=tags_metadata, root_path=root_path
 
 app.include_router(root.router)
 app.include_router(channels.router, prefix="/channels")
+app.include_router(channels.maintenance_router, prefix="/maintenance/channels")
 app.include_router(dashboards.router, prefix="/dashboard")
 app.include_router(dashboards.maintenance_router, prefix="/maintenance/dashboard")
 
@@ -1,46 +1,194 @@
+import asyncio
 import logging
 import time
+from functools import partial
+from typing import Any, Dict
 
-from fastapi import APIRouter, HTTPException, Request
+import orjson
+from fastapi import APIRouter, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 
+from shared_resources.cancellation import CancellationToken, RequestCancelled
 from shared_resources.channel_service import (
+    CURVE_STREAM_TIMEOUT_SECONDS,
+    channel_exists,
+    fetch_live_events,
+    get_catalog_response,
     get_curve_data,
+    get_curves,
     get_raw_data_link,
     get_recent_channels,
+    get_search_result_cache_stats,
+    rank_channels,
     search_channels,
+    stream_curve_data,
+    transform_live_events,
+    update_recent_channels,
 )
-from shared_resources.decorators import timeout
+from shared_resources.curve_encoding import (
+    ARROW_STREAM_MEDIA_TYPE,
+    CBOR_MEDIA_TYPE,
+    JSON_MEDIA_TYPE,
+    encode_cbor,
+    encode_curve,
+    encode_json,
+    negotiate_media_type,
+    quality_values,
+    supported_media_types,
+)
+from shared_resources.decorators import executor_stats, run_in_executor, stream, timeout
+from shared_resources.downsampling import DOWNSAMPLING_METHODS
+from shared_resources.live_updates import LiveSubscriber
 
 logger = logging.getLogger("uvicorn")
 
+CURVE_FORMATS = ("default", "columnar")
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CBOR_SEQUENCE_MEDIA_TYPE = "application/cbor-seq"
+
 router = APIRouter(tags=["channels"])
+maintenance_router = APIRouter(tags=["channels", "maintenance"])
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Whether the Accept-Encoding header allows gzip, explicitly or through *, with a q value above 0."""
+    codings = quality_values(accept_encoding)
+    return codings.get("gzip", codings.get("*", 0.0)) > 0
+
+
+def catalog_response(request: Request, cached: dict) -> Response:
+    gzipped = cached["gzip_body"] is not None and accepts_gzip(request.headers.get("accept-encoding", ""))
+    etag = cached["gzip_etag"] if gzipped else cached["etag"]
+    headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+
+    # If-None-Match uses the weak comparison, so W/ prefixes added by proxies don't matter
+    client_etags = {tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")}
+    if etag in client_etags or "*" in client_etags:
+        return Response(status_code=304, headers=headers)
+
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return Response(
+        content=cached["gzip_body"] if gzipped else cached["body"], media_type="application/json", headers=headers
+    )
+
+
+def curve_response(result: dict, media_type: str, columnar: bool):
+    if media_type == JSON_MEDIA_TYPE and not columnar:
+        return result
+    try:
+        content = encode_curve(result, media_type)
+    except ValueError as e:
+        raise HTTPException(status_code=406, detail=str(e)) from e
+    return Response(content=content, media_type=media_type, headers={"Vary": "Accept"})
+
+
+def curve_error(e: Exception) -> str:
+    """Returns the error to report for a curve that could not be fetched, telling if the request timed out."""
+    # Streamed curves wrap the errors of their query
+    cancelled = e.__cause__ if isinstance(e.__cause__, RequestCancelled) else e
+    return str(cancelled) if isinstance(cancelled, RequestCancelled) else "Error fetching data from backend"
+
+
+def curve_stream_response(chunks, media_type: str) -> StreamingResponse:
+    """
+    Streams the curve chunks as newline delimited JSON, or as CBOR sequence if CBOR is preferred. An error,
+    also past CURVE_STREAM_TIMEOUT_SECONDS, ends the stream with a frame holding only the error.
+    """
+    if media_type == ARROW_STREAM_MEDIA_TYPE:
+        raise HTTPException(status_code=406, detail="Streamed curves can't be encoded as Arrow")
+    if media_type == CBOR_MEDIA_TYPE:
+        encode, stream_media_type = encode_cbor, CBOR_SEQUENCE_MEDIA_TYPE
+    else:
+        encode, stream_media_type = (lambda chunk: encode_json(chunk) + b"\n"), NDJSON_MEDIA_TYPE
+
+    def frames():
+        try:
+            for chunk in chunks:
+                yield encode(chunk)
+        except Exception as e:
+            logger.error(f"Error in curve_stream_response: {e!r}")
+            yield encode({"error": curve_error(e)})
+
+    return StreamingResponse(
+        stream(frames(), CURVE_STREAM_TIMEOUT_SECONDS), media_type=stream_media_type, headers={"Vary": "Accept"}
+    )
+
+
+def validate_curve_time_range(begin_time: int, end_time: int):
+    """Returns the end time, capped to the present."""
+    if begin_time * end_time == 0:
+        raise HTTPException(
+            status_code=400,
+            detail="begin_time or end_time is invalid, must be valid unix time (seconds)",
+        )
+    if begin_time > end_time:
+        raise HTTPException(
+            status_code=400,
+            detail="begin_time is bigger than end_time, must be smaller or equal",
+        )
+    if end_time > time.time() * 1000:
+        return time.time() * 1000
+    return end_time
+
+
+def validate_downsampling(max_points: int | None, downsampling: str):
+    if max_points is not None and max_points < 4:
+        raise HTTPException(status_code=400, detail="max_points must be at least 4")
+    if downsampling not in DOWNSAMPLING_METHODS:
+        raise HTTPException(status_code=400, detail=f"downsampling must be one of {', '.join(DOWNSAMPLING_METHODS)}")
 
 
 @router.get("/search", description="Searches the cache for a channel. If not found in cache, archivers will be queried")
-@timeout(15)
-def search_channels_route(request: Request, search_text: str = "", allow_cached_response=True, backend=None):
+@timeout(15, executor="data")
+def search_channels_route(
+    request: Request,
+    search_text: str = "",
+    allow_cached_response=True,
+    backend=None,
+    limit: int | None = None,
+    cursor: str | None = None,
+):
     shared = request.app.state.shared
-    channels = []
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+
     if search_text == "" and allow_cached_response:
-        # Return all channels
-        channels = list(shared.available_backend_channels)
+        if limit is None:
+            # Return all channels, encoded only once per catalog version
+            return catalog_response(request, get_catalog_response(shared))
+        channels = shared.channel_catalog.rows()
     else:
         # Workaround to sf-databuffer not offering a way to correctly cache channels.
         # With this many characters in the search text, the search should be fairly performant.
         if len(search_text) > 4:
             allow_cached_response = False
+        # Ranked pages only convert the channels they return
         channels = search_channels(
-            shared, search_text=search_text.strip(), allow_cached_response=allow_cached_response, backend=backend
+            shared,
+            search_text=search_text.strip(),
+            allow_cached_response=allow_cached_response,
+            backend=backend,
+            materialize=limit is None,
         )
 
+    next_cursor = None
+    if limit is not None:
+        try:
+            channels, next_cursor = rank_channels(channels, search_text.strip(), limit, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e)) from e
+
     # To avoid precision loss in browsers, transmit seriresId as string
     processed_channels = []
     for channel in channels:
-        channel_copy = channel.copy()
+        channel_copy = dict(channel)
         if isinstance(channel_copy.get("seriesId"), int):
             channel_copy["seriesId"] = str(channel_copy["seriesId"])
         processed_channels.append(channel_copy)
     result = {"channels": processed_channels}
+    if limit is not None:
+        result["next_cursor"] = next_cursor
 
     return result
 
@@ -54,8 +202,23 @@ def recent_channels_route(request: Request):
     return result
 
 
-@router.get("/curve", description="Returns channel data for the specified parameters")
-@timeout(60)
+@router.get(
+    "/curve",
+    description="Returns channel data for the specified parameters. With format=columnar, the curve is returned as "
+    "parallel arrays (timestamps, values, min, max, count, pulseId and dictionary encoded desc) instead of maps "
+    "keyed by timestamp. Waveform values are then one (events x samples) block, padded with null if the lengths "
+    "differ. Besides JSON, the curve can be requested as CBOR (Accept: application/cbor), with numeric "
+    "columns as RFC 8746 little-endian typed arrays, or as Arrow IPC stream (Accept: "
+    "application/vnd.apache.arrow.stream), which implies format=columnar. With useEventsIfBinCountTooLarge, "
+    "plan in the meta tells whether raw events or bins were fetched, and whether that was decided by the known "
+    "event rate of the channel, a count probe or because the events are waveforms. With max_points, raw events "
+    "are downsampled to at most that many points, keeping the first, last, minimum and maximum event per bucket "
+    "of time (downsampling=m4) or the most significant event per bucket (downsampling=lttb). The meta then "
+    "tells in downsampled the method, the number of events and of points kept. With stream, the curve is sent in "
+    "parts as the data arrives, each a curve of its own, as newline delimited JSON or as CBOR sequence "
+    "(application/cbor-seq) if CBOR is accepted.",
+)
+@timeout(60, executor="data")
 def curve_data_route(
     request: Request,
     channel_name: str,
@@ -66,38 +229,52 @@ def curve_data_route(
     useEventsIfBinCountTooLarge: bool = False,
     removeEmptyBins: bool = False,
     isString: bool | None = None,
+    format: str = "default",
+    max_points: int | None = None,
+    downsampling: str = "m4",
+    stream: bool = False,
 ):
     shared = request.app.state.shared
-    entry = {}
+    if format not in CURVE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(CURVE_FORMATS)}")
+    validate_downsampling(max_points, downsampling)
+    if stream and max_points is not None:
+        raise HTTPException(status_code=400, detail="max_points can't be used with stream")
+    media_type = negotiate_media_type(request.headers.get("accept", ""))
+    if media_type is None:
+        raise HTTPException(status_code=406, detail=f"Supported media types: {', '.join(supported_media_types())}")
+    # Arrow is a columnar format in itself
+    columnar = format == "columnar" or media_type == ARROW_STREAM_MEDIA_TYPE
     # If the channel name can be converted to an integer, treat it as seriesId.
     if channel_name.isdigit():
-        entry = next(
-            (item for item in shared.available_backend_channels if item["seriesId"] == channel_name),
-            None,
-        )
+        entry = shared.channel_catalog.find_by_series_id(channel_name)
     else:
-        entry = next(
-            (item for item in shared.available_backend_channels if item["name"] == channel_name),
-            None,
-        )
+        entry = shared.channel_catalog.find(channel_name, backend)
+    entry = entry.to_dict() if entry else None
     if isString is None:
         isString = entry and entry["type"] == "string"
 
     # Don't verify channel if seriesId is used
-    if not channel_name.isdigit() and not search_channels(shared, channel_name.strip()):
+    if not channel_name.isdigit() and not channel_exists(shared, channel_name):
         raise HTTPException(status_code=404, detail="Channel not found in backend")
-    if begin_time * end_time == 0:
-        raise HTTPException(
-            status_code=400,
-            detail="begin_time or end_time is invalid, must be valid unix time (seconds)",
-        )
-    if begin_time > end_time:
-        raise HTTPException(
-            status_code=400,
-            detail="begin_time is bigger than end_time, must be smaller or equal",
+    end_time = validate_curve_time_range(begin_time, end_time)
+
+    if stream:
+        chunks = stream_curve_data(
+            shared,
+            channel_name=channel_name,
+            begin_time=begin_time,
+            end_time=end_time,
+            backend=backend,
+            num_bins=num_bins,
+            useEventsIfBinCountTooLarge=useEventsIfBinCountTooLarge,
+            removeEmptyBins=removeEmptyBins,
+            channel_entry=entry,
+            timeout=50,
+            isString=isString,
+            columnar=columnar,
         )
-    if end_time > time.time() * 1000:
-        end_time = time.time() * 1000
+        return curve_stream_response(chunks, media_type)
 
     try:
         result = get_curve_data(
@@ -112,14 +289,191 @@ def curve_data_route(
             channel_entry=entry,
             timeout=50,
             isString=isString,
+            columnar=columnar,
+            max_points=max_points,
+            downsampling=downsampling,
         )
-
-        return result
+        return curve_response(result, media_type, columnar)
     except RuntimeError as e:
         logger.error(f"Error in curve_data_route: {e}")
         raise HTTPException(status_code=500, detail="Error fetching data from backend") from e
 
 
+def batch_curve_channels(shared, channels: list) -> tuple[list[dict], list[dict]]:
+    """Resolves the channels of a batch curve request, returns the existing ones and the missing ones."""
+    resolved, missing = [], []
+    for channel in channels:
+        if not isinstance(channel, dict) or not isinstance(channel.get("channel_name"), str):
+            raise HTTPException(status_code=400, detail="channels must be objects with a channel_name")
+        channel_name = channel["channel_name"]
+        backend = channel.get("backend", "sf-databuffer")
+        # If the channel name can be converted to an integer, treat it as seriesId.
+        if channel_name.isdigit():
+            entry = shared.channel_catalog.find_by_series_id(channel_name)
+        else:
+            entry = shared.channel_catalog.find(channel_name, backend)
+        entry = entry.to_dict() if entry else None
+        isString = channel.get("isString")
+        if isString is None:
+            isString = bool(entry and entry["type"] == "string")
+        channel = {"channel_name": channel_name, "backend": backend, "isString": isString}
+
+        # Don't verify channel if seriesId is used
+        if not channel_name.isdigit() and not channel_exists(shared, channel_name):
+            missing.append(channel)
+            continue
+        update_recent_channels(shared, entry)
+        resolved.append(channel)
+    return resolved, missing
+
+
+def curve_lines(missing: list[dict], curves):
+    """Yields one NDJSON line per channel, missing channels first, then the curves as they become ready."""
+    for channel in missing:
+        yield orjson.dumps({**channel, "error": "Channel not found in backend"}) + b"\n"
+    for channel, curve in curves:
+        if isinstance(curve, Exception):
+            yield orjson.dumps({**channel, "error": curve_error(curve)}) + b"\n"
+        else:
+            yield encode_json({**channel, **curve}) + b"\n"
+
+
+@router.post(
+    "/curves",
+    description="Returns the data of several channels for the same time range. The body holds the parameters of "
+    "/curve, except channel_name, backend and isString, which are given per channel in a list of channels, e.g. "
+    '{"begin_time": 0, "end_time": 1, "num_bins": 100, "channels": [{"channel_name": "a", "backend": '
+    '"sf-databuffer"}]}. Channels of the same backend are fetched together, and the curves are streamed as '
+    "newline delimited JSON in the order they become ready, one line per channel with its channel_name, backend "
+    "and either the curve or an error.",
+)
+@timeout(60, executor="data")
+def curves_data_route(request: Request, body: Dict[str, Any]):
+    shared = request.app.state.shared
+    try:
+        begin_time = int(body["begin_time"])
+        end_time = int(body["end_time"])
+        num_bins = int(body.get("num_bins", 0))
+        max_points = None if body.get("max_points") is None else int(body["max_points"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(
+            status_code=400, detail="begin_time, end_time, num_bins and max_points must be integers"
+        ) from e
+    format = body.get("format", "default")
+    if format not in CURVE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(CURVE_FORMATS)}")
+    downsampling = body.get("downsampling", "m4")
+    validate_downsampling(max_points, downsampling)
+    if not isinstance(body.get("channels"), list) or not body["channels"]:
+        raise HTTPException(status_code=400, detail="channels must be a non-empty list")
+    end_time = validate_curve_time_range(begin_time, end_time)
+
+    channels, missing = batch_curve_channels(shared, body["channels"])
+    curves = get_curves(
+        shared,
+        channels,
+        begin_time=begin_time,
+        end_time=end_time,
+        num_bins=num_bins,
+        useEventsIfBinCountTooLarge=bool(body.get("useEventsIfBinCountTooLarge", False)),
+        removeEmptyBins=bool(body.get("removeEmptyBins", False)),
+        timeout=50,
+        columnar=format == "columnar",
+        max_points=max_points,
+        downsampling=downsampling,
+    )
+    # The curves are fetched while streaming, with a deadline of their own
+    return StreamingResponse(
+        stream(curve_lines(missing, curves), CURVE_STREAM_TIMEOUT_SECONDS), media_type=NDJSON_MEDIA_TYPE
+    )
+
+
+def live_frame(backend: str, channel_name: str, isString: bool, records: list, columnar: bool) -> str:
+    curve = transform_live_events(records, channel_name, isString, columnar)
+    return encode_json({"channel_name": channel_name, "backend": backend, **curve}).decode()
+
+
+def live_message_channels(message, field: str) -> list[dict]:
+    """Returns the channels of the subscribe or unsubscribe field of a live message, raises a ValueError if invalid."""
+    channels = message.get(field, [])
+    if not isinstance(channels, list) or not all(
+        isinstance(channel, dict)
+        and isinstance(channel.get("channel_name"), str)
+        and isinstance(channel.get("backend", ""), str)
+        for channel in channels
+    ):
+        raise ValueError(f"{field} must be a list of objects with a channel_name")
+    return channels
+
+
+async def receive_live_subscriptions(websocket: WebSocket, subscriber: LiveSubscriber, token: CancellationToken):
+    """Applies the subscribe and unsubscribe messages of the client, until it disconnects."""
+    shared = websocket.app.state.shared
+    fetch = partial(fetch_live_events, shared)
+    while True:
+        try:
+            message = orjson.loads(await websocket.receive_text())
+            if not isinstance(message, dict):
+                raise ValueError("Messages must be objects")
+            unsubscribe = live_message_channels(message, "unsubscribe")
+            channels, missing = await run_in_executor(
+                "data", token, batch_curve_channels, shared, live_message_channels(message, "subscribe")
+            )
+        except HTTPException as e:
+            await websocket.send_json({"error": e.detail})
+            continue
+        except ValueError as e:
+            await websocket.send_json({"error": str(e)})
+            continue
+
+        for channel in missing:
+            await websocket.send_json({**channel, "error": "Channel not found in backend"})
+        for channel in channels:
+            shared.live_hub.subscribe(
+                subscriber, channel["backend"], channel["channel_name"], channel["isString"], fetch
+            )
+        for channel in unsubscribe:
+            shared.live_hub.unsubscribe(subscriber, channel.get("backend", "sf-databuffer"), channel["channel_name"])
+
+
+@router.websocket("/live")
+async def live_route(websocket: WebSocket, format: str = "default"):
+    """
+    Pushes new events of the subscribed channels. Clients send {"subscribe": [...], "unsubscribe": [...]} with
+    channels like those of POST /curves, and receive a frame with the channel_name, backend and curve of each
+    channel whenever it has new events. Each channel is polled once for all subscribers. A slow client is sent
+    all events it missed in one frame per channel once it is ready again.
+    """
+    await websocket.accept()
+    if format not in CURVE_FORMATS:
+        await websocket.close(code=1008, reason=f"format must be one of {', '.join(CURVE_FORMATS)}")
+        return
+
+    hub = websocket.app.state.shared.live_hub
+    subscriber = LiveSubscriber()
+    # Cancelled with the socket, aborting the lookups and encodings still running for it
+    token = CancellationToken()
+    receiver = asyncio.create_task(receive_live_subscriptions(websocket, subscriber, token))
+    try:
+        while not receiver.done():
+            changed = asyncio.create_task(subscriber.changed.wait())
+            await asyncio.wait((receiver, changed), return_when=asyncio.FIRST_COMPLETED)
+            changed.cancel()
+            subscriber.changed.clear()
+            for backend, channel_name, isString, records in subscriber.deltas(hub):
+                frame = await run_in_executor(
+                    "data", token, live_frame, backend, channel_name, isString, records, format == "columnar"
+                )
+                await websocket.send_text(frame)
+        receiver.result()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        token.cancel()
+        hub.unsubscribe_all(subscriber)
+
+
 @router.get("/raw-link", description="Returns a link to download raw data directly from data-api")
 @timeout(5)
 def raw_data_link_route(
@@ -142,3 +496,21 @@ def raw_data_link_route(
     except RuntimeError as e:
         logger.error(f"Error in raw_data_link_route: {e}")
         raise HTTPException(status_code=500, detail="Error assembling link") from e
+
+
+@maintenance_router.get("/stats", description="Returns statistics about the channel catalog and its synchronization")
+def channel_stats_route(request: Request):
+    shared = request.app.state.shared
+    return {
+        "catalog": shared.channel_catalog.memory_footprint(),
+        "search_cache": get_search_result_cache_stats(shared),
+        "curve_cache": shared.curve_cache.stats(),
+        "curve_fetches": shared.curve_flights.stats(),
+        "live_tail_cache": shared.live_tail_cache.stats(),
+        "raw_segment_cache": shared.raw_segment_cache.stats(),
+        "daqbuf_pools": {str(backend): pool.stats() for backend, pool in list(shared.daqbuf_pools.items())},
+        "live_updates": shared.live_hub.stats(),
+        "route_executors": executor_stats(),
+        "curve_plans": {"event_rates": len(shared.event_rate_cache), "reasons": dict(shared.curve_plan_stats)},
+        "sync": {backend: dict(stats) for backend, stats in shared.backend_sync_stats.items()},
+    }
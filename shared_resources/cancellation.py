@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from threading import Event, Lock
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+class CancellationToken:
+    """
+    Cancellation of a request, aborting the Daqbuf sources its threads are querying.
+
+    Daqbuf only checks for the abort between records, so an aborted query stops soon but not instantly.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._cancelled = Event()
+        self._sources = set()
+        self.reason = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self, reason: str = "Request cancelled"):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.reason = reason
+            self._cancelled.set()
+            sources = list(self._sources)
+        for source in sources:
+            source.abort()
+
+    def add(self, source):
+        with self._lock:
+            if self.cancelled:
+                raise RequestCancelled(self.reason)
+            self._sources.add(source)
+
+    def discard(self, source):
+        with self._lock:
+            self._sources.discard(source)
+
+
+# Token of the request the current thread works for, None outside of requests
+current_token = ContextVar("current_token", default=None)
+
+
+def raise_if_cancelled():
+    token = current_token.get()
+    if token is not None and token.cancelled:
+        raise RequestCancelled(token.reason)
+
+
+@contextmanager
+def cancellable(source):
+    """
+    Aborts the source if the current request is cancelled while in the context, and raises RequestCancelled on
+    leaving it then, so the partial result is not used and the source is not reused.
+    """
+    token = current_token.get()
+    if token is None:
+        yield source
+        return
+    token.add(source)
+    try:
+        yield source
+    finally:
+        token.discard(source)
+    raise_if_cancelled()
+
+
+def submit(executor, fn, *args, **kwargs):
+    """Submits fn to the executor, running it in a copy of the current context so it keeps the request's token."""
+    return executor.submit(copy_context().run, fn, *args, **kwargs)
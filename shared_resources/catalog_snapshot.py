@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import struct
+import sys
+import time
+from array import array
+
+import gridfs
+
+from shared_resources.channel_catalog import ChannelCatalog
+from shared_resources.variables import SharedState
+
+logger = logging.getLogger("uvicorn")
+
+PERSIST_CHANNEL_CATALOG = os.getenv("PERSIST_CHANNEL_CATALOG", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+    "on",
+)
+
+SNAPSHOT_MAGIC = b"DBCATLG"
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_FILENAME = "channel_catalog"
+SNAPSHOT_COLLECTION = "channel_catalog_snapshots"
+
+
+def dump_catalog(catalog: ChannelCatalog) -> bytes:
+    """
+    Encodes the catalog as a binary snapshot.
+
+    Layout: magic, format version and header length, followed by a JSON header and the raw buffers of all
+    array, bytes and str columns in header order. Everything else is stored in the header. Buffers are not
+    compressed, decompressing would take longer than loading the catalog itself.
+    """
+    header = {"format": SNAPSHOT_FORMAT_VERSION, "created": time.time(), "byteorder": sys.byteorder}
+    sections = []
+    buffers = []
+    for key, value in catalog.to_columns().items():
+        if isinstance(value, array):
+            data = value.tobytes()
+            sections.append([key, "array", value.typecode, len(data)])
+        elif isinstance(value, (bytes, bytearray)):
+            data = bytes(value)
+            sections.append([key, "bytes", None, len(data)])
+        elif isinstance(value, str):
+            data = value.encode()
+            sections.append([key, "str", None, len(data)])
+        else:
+            header[key] = value
+            continue
+        buffers.append(data)
+    header["sections"] = sections
+    encoded_header = json.dumps(header).encode()
+    return b"".join(
+        [SNAPSHOT_MAGIC, struct.pack("<HI", SNAPSHOT_FORMAT_VERSION, len(encoded_header)), encoded_header, *buffers]
+    )
+
+
+def load_catalog(snapshot: bytes) -> tuple[ChannelCatalog, float]:
+    """Decodes a snapshot created by dump_catalog(), returns the catalog and when the snapshot was created."""
+    if not snapshot.startswith(SNAPSHOT_MAGIC):
+        raise ValueError("Not a channel catalog snapshot")
+    offset = len(SNAPSHOT_MAGIC)
+    format_version, header_length = struct.unpack_from("<HI", snapshot, offset)
+    if format_version != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {format_version}")
+    offset += struct.calcsize("<HI")
+    header = json.loads(snapshot[offset : offset + header_length])
+    if header["byteorder"] != sys.byteorder:
+        raise ValueError("Snapshot was created on a machine with different byte order")
+    payload = memoryview(snapshot)[offset + header_length :]
+
+    columns = {key: value for key, value in header.items() if key not in ("format", "created", "byteorder", "sections")}
+    position = 0
+    for key, kind, typecode, length in header["sections"]:
+        data = payload[position : position + length]
+        position += length
+        if kind == "array":
+            columns[key] = array(typecode)
+            columns[key].frombytes(data)
+        elif kind == "bytes":
+            columns[key] = bytes(data)
+        else:
+            columns[key] = str(data, "utf-8")
+    return ChannelCatalog.from_columns(columns), header["created"]
+
+
+def save_catalog_snapshot(shared: SharedState, catalog: ChannelCatalog):
+    if not PERSIST_CHANNEL_CATALOG:
+        return
+    try:
+        # Appends while dumping would leave the columns inconsistent
+        with shared.channel_catalog_lock:
+            snapshot = dump_catalog(catalog)
+        fs = gridfs.GridFS(shared.mongo_db, collection=SNAPSHOT_COLLECTION)
+        file_id = fs.put(snapshot, filename=SNAPSHOT_FILENAME, metadata={"format": SNAPSHOT_FORMAT_VERSION})
+        # Only keep the snapshot just written
+        for old in fs.find({"filename": SNAPSHOT_FILENAME, "_id": {"$ne": file_id}}):
+            fs.delete(old._id)
+        logger.info(f"Saved channel catalog snapshot with {len(catalog)} channels ({len(snapshot)} bytes).")
+    except Exception as e:
+        logger.error(f"Could not save channel catalog snapshot: {e}")
+
+
+def load_catalog_snapshot(shared: SharedState):
+    if not PERSIST_CHANNEL_CATALOG:
+        return None
+    try:
+        fs = gridfs.GridFS(shared.mongo_db, collection=SNAPSHOT_COLLECTION)
+        start = time.perf_counter()
+        catalog, created = load_catalog(fs.get_last_version(SNAPSHOT_FILENAME).read())
+        logger.info(
+            f"Loaded channel catalog snapshot with {len(catalog)} channels from {time.ctime(created)} "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms."
+        )
+        return catalog
+    except gridfs.NoFile:
+        logger.info("No channel catalog snapshot found.")
+    except Exception as e:
+        logger.error(f"Could not load channel catalog snapshot: {e}")
+    return None
@@ -0,0 +1,431 @@
+import re
+import sys
+from array import array
+from collections.abc import Mapping
+
+from shared_resources.channel_index import ChannelIndex
+
+CHANNEL_FIELDS = ("backend", "name", "seriesId", "source", "type", "shape", "unit", "description")
+INTERNED_FIELDS = ("backend", "source", "type", "shape", "unit", "description")
+
+
+def normalize_channel(channel) -> dict:
+    return {
+        "backend": str(channel.get("backend", "")),
+        "name": str(channel.get("name", "")),
+        "seriesId": str(channel.get("seriesId", "")),
+        "source": str(channel.get("source", "")),
+        "type": str(channel.get("type", "")),
+        "shape": channel.get("shape", ""),  # May be []
+        "unit": str(channel.get("unit", "")),
+        "description": str(channel.get("description", "")),
+    }
+
+
+def is_numeric_series_id(series_id: str) -> bool:
+    # isdigit() alone also accepts digits int() doesn't parse, like "²"
+    return series_id.isascii() and series_id.isdigit() and len(series_id) < 19 and str(int(series_id)) == series_id
+
+
+def series_id_key(series_id: str):
+    # Numeric seriesIds are kept as ints, which take less memory than their string representation
+    return int(series_id) if is_numeric_series_id(series_id) else series_id
+
+
+def channel_key(channel) -> tuple:
+    return channel["backend"], channel["seriesId"], channel["name"]
+
+
+def deep_size(value) -> int:
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key) + deep_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_size(item) for item in value)
+    return size
+
+
+class InternTable:
+    """Maps repeated values to small integer codes, so each distinct value is only stored once."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value) -> int:
+        # Lists (shapes) aren't hashable, but their tuple equivalent is
+        key = (list, tuple(value)) if isinstance(value, list) else value
+        code = self.codes.get(key)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.codes[key] = code
+        return code
+
+    def value(self, code):
+        value = self.values[code]
+        # Hand out copies of mutable values, so callers can't alter the interned one
+        return list(value) if isinstance(value, list) else value
+
+    def memory_footprint(self) -> int:
+        return sys.getsizeof(self.values) + sys.getsizeof(self.codes) + sum(deep_size(v) for v in self.values)
+
+
+class ChannelRow(Mapping):
+    """Lightweight read-only view of a single catalog row, behaving like the channel dict it was built from."""
+
+    __slots__ = ("_catalog", "_row")
+
+    def __init__(self, catalog, row: int):
+        self._catalog = catalog
+        self._row = row
+
+    def __getitem__(self, field):
+        return self._catalog.value(self._row, field)
+
+    def __iter__(self):
+        return iter(CHANNEL_FIELDS)
+
+    def __len__(self):
+        return len(CHANNEL_FIELDS)
+
+    def __repr__(self):
+        return f"ChannelRow({self.to_dict()!r})"
+
+    def to_dict(self) -> dict:
+        return {field: self[field] for field in CHANNEL_FIELDS}
+
+
+class ChannelCatalog:
+    """
+    Columnar store of all known channels.
+
+    Repeated strings (backend, type, unit, ...) are interned and referenced by code, names are stored utf-8
+    encoded in one contiguous buffer, and numeric seriesIds in an integer array. Only the rows actually handed
+    out are materialized, as ChannelRow views or dicts.
+
+    Columns are only ever appended to, removed rows are just marked as such until the catalog is compacted.
+    Columns are written before the row count is increased, so reads don't require any locking and simply don't
+    see rows added concurrently. Appending and removing has to be synchronized by the caller.
+    """
+
+    def __init__(self, channels=()):
+        self._size = 0
+        self._removed = bytearray()
+        self._removed_count = 0
+        # Incremented on every change, so derived data can tell whether it is still up to date
+        self.version = 0
+        self._interned = {field: InternTable() for field in INTERNED_FIELDS}
+        self._codes = {field: array("I") for field in INTERNED_FIELDS}
+        self._names = bytearray()
+        self._name_offsets = array("Q", [0])
+        # seriesIds are numeric in practice, anything else is kept aside by row
+        self._series_ids = array("q")
+        self._other_series_ids = {}
+        # Hash indexes for exact lookups, pointing to the first row with the given key.
+        # Names are mostly unique across backends, so only repeated ones are additionally keyed by backend.
+        self._rows_by_name = {}
+        self._rows_by_backend_and_name = {}
+        self._rows_by_series_id = {}
+        self.index = ChannelIndex()
+        self.append(channels)
+
+    def __len__(self):
+        return self._size - self._removed_count
+
+    def __iter__(self):
+        return iter(self.rows())
+
+    @property
+    def removed_count(self) -> int:
+        return self._removed_count
+
+    def is_live(self, row: int) -> bool:
+        return row < self._size and not self._removed[row]
+
+    def append(self, channels) -> list[ChannelRow]:
+        channels = [normalize_channel(channel) for channel in channels]
+        start = self._size
+        for row, channel in enumerate(channels, start):
+            for field in INTERNED_FIELDS:
+                self._codes[field].append(self._interned[field].code(channel[field]))
+            self._names += channel["name"].encode()
+            self._name_offsets.append(len(self._names))
+            series_id = channel["seriesId"]
+            if is_numeric_series_id(series_id):
+                self._series_ids.append(int(series_id))
+            else:
+                self._series_ids.append(-1)
+                self._other_series_ids[row] = series_id
+            self._removed.append(0)
+            self._add_to_lookups(row, channel["name"], channel["backend"], series_id)
+        self.index.add(channel["name"] for channel in channels)
+        self._size = start + len(channels)
+        if channels:
+            self.version += 1
+        return self.rows(range(start, self._size))
+
+    def remove(self, keys) -> int:
+        """Removes the channels with the given (backend, seriesId, name) keys, returns the number of removed rows."""
+        removed = 0
+        for backend, series_id, name in keys:
+            for row in self._rows_of(backend, series_id, name):
+                self._removed[row] = 1
+                self._removed_count += 1
+                removed += 1
+                self._remove_from_lookups(row, backend, name, series_id)
+        if removed:
+            self.version += 1
+        return removed
+
+    def _remove_from_lookups(self, row, backend, name, series_id):
+        key = series_id_key(series_id)
+        rows = self._rows_by_series_id.get(key)
+        if rows == row:
+            del self._rows_by_series_id[key]
+        elif isinstance(rows, list) and row in rows:
+            remaining = [other for other in rows if other != row]
+            self._rows_by_series_id[key] = remaining[0] if len(remaining) == 1 else remaining
+
+        if self._rows_by_name.get(name) != row and self._rows_by_backend_and_name.get((backend, name)) != row:
+            return
+        # Other rows with the same name may have been hidden behind the removed one, so rebuild the name entries
+        rows = [other for other in self.index.search(f"^{re.escape(name.lower())}$") if self.name(other) == name]
+        self._rows_by_name.pop(name, None)
+        for other in rows:
+            self._rows_by_backend_and_name.pop((self.value(other, "backend"), name), None)
+        for other in rows:
+            if self.is_live(other):
+                self._add_name_to_lookups(other, name, self.value(other, "backend"))
+
+    def compacted(self):
+        """Returns a new catalog without the removed rows."""
+        return ChannelCatalog(self.to_dicts())
+
+    def keys(self, backend: str = None) -> set:
+        """Returns the (backend, seriesId, name) keys of all channels, or of those in the given backend."""
+        backend_code = self._interned["backend"].codes.get(backend)
+        if backend is not None and backend_code is None:
+            return set()
+        backend_codes = self._codes["backend"]
+        return {
+            (self.value(row, "backend"), self.value(row, "seriesId"), self.name(row))
+            for row in range(self._size)
+            if not self._removed[row] and (backend is None or backend_codes[row] == backend_code)
+        }
+
+    def _add_to_lookups(self, row, name, backend, series_id):
+        self._add_name_to_lookups(row, name, backend)
+        self._add_series_id_to_lookup(row, series_id)
+
+    def _add_name_to_lookups(self, row, name, backend):
+        first_row = self._rows_by_name.setdefault(name, row)
+        if first_row != row and backend != self.value(first_row, "backend", check_size=False):
+            self._rows_by_backend_and_name.setdefault((backend, name), row)
+
+    def _add_series_id_to_lookup(self, row, series_id):
+        # seriesIds are unique per backend, so there are hardly ever several rows per key
+        key = series_id_key(series_id)
+        rows = self._rows_by_series_id.get(key)
+        if rows is None:
+            self._rows_by_series_id[key] = row
+        elif isinstance(rows, int):
+            self._rows_by_series_id[key] = [rows, row]
+        else:
+            rows.append(row)
+
+    def to_columns(self) -> dict:
+        """Returns the raw columns, from_columns() turns them back into an equivalent catalog."""
+        return {
+            "size": self._size,
+            "interned": {field: table.values for field, table in self._interned.items()},
+            **{f"codes_{field}": codes for field, codes in self._codes.items()},
+            "names": self._names,
+            "name_offsets": self._name_offsets,
+            "series_ids": self._series_ids,
+            "removed": self._removed,
+            "other_series_ids": {str(row): series_id for row, series_id in self._other_series_ids.items()},
+            **{f"index_{key}": value for key, value in self.index.to_columns().items()},
+        }
+
+    @classmethod
+    def from_columns(cls, columns: dict):
+        catalog = cls()
+        size = columns["size"]
+        for field in INTERNED_FIELDS:
+            for value in columns["interned"][field]:
+                catalog._interned[field].code(value)
+            catalog._codes[field] = columns[f"codes_{field}"]
+        catalog._names = bytearray(columns["names"])
+        catalog._name_offsets = columns["name_offsets"]
+        catalog._series_ids = columns["series_ids"]
+        catalog._removed = bytearray(columns["removed"])
+        catalog._removed_count = catalog._removed.count(1)
+        catalog._other_series_ids = {int(row): series_id for row, series_id in columns["other_series_ids"].items()}
+        if not all(len(catalog._codes[field]) == size for field in INTERNED_FIELDS) or (
+            len(catalog._series_ids) != size or len(catalog._name_offsets) != size + 1 or len(catalog._removed) != size
+        ):
+            raise ValueError("Inconsistent catalog columns")
+
+        catalog._build_lookups(size)
+        catalog.index = ChannelIndex.from_columns(
+            {key.removeprefix("index_"): value for key, value in columns.items() if key.startswith("index_")}
+        )
+        if len(catalog.index) != size:
+            raise ValueError("Inconsistent catalog index")
+        catalog._size = size
+        return catalog
+
+    def _decode_names(self, size):
+        names = self._names.decode()
+        offsets = self._name_offsets
+        if len(names) == len(self._names):
+            # Pure ASCII, so byte offsets are character offsets as well
+            return [names[offsets[row] : offsets[row + 1]] for row in range(size)]
+        return [self.name(row) for row in range(size)]
+
+    def _build_lookups(self, size):
+        # Bulk version of _add_to_lookups() for all rows, only rows with repeated keys are handled one by one
+        names = self._decode_names(size)
+        if self._removed_count:
+            for row, name in enumerate(names):
+                if not self._removed[row]:
+                    self._add_to_lookups(
+                        row,
+                        name,
+                        self.value(row, "backend", check_size=False),
+                        self.value(row, "seriesId", check_size=False),
+                    )
+            return
+        rows = range(size - 1, -1, -1)
+        # Iterating in reverse lets the first row win for repeated keys
+        self._rows_by_name = dict(zip(reversed(names), rows, strict=True))
+        self._rows_by_series_id = dict(zip(reversed(self._series_ids), rows, strict=True))
+        self._rows_by_backend_and_name = {}
+
+        if len(self._rows_by_name) < size:
+            for row, name in enumerate(names):
+                first_row = self._rows_by_name[name]
+                if first_row != row and self._codes["backend"][row] != self._codes["backend"][first_row]:
+                    backend = self.value(row, "backend", check_size=False)
+                    self._rows_by_backend_and_name.setdefault((backend, name), row)
+
+        if len(self._rows_by_series_id) < size or -1 in self._rows_by_series_id:
+            self._rows_by_series_id.pop(-1, None)
+            for row, series_id in enumerate(self._series_ids):
+                if series_id < 0 or self._rows_by_series_id[series_id] != row:
+                    self._add_series_id_to_lookup(row, self.value(row, "seriesId", check_size=False))
+
+    def name(self, row: int) -> str:
+        return self._names[self._name_offsets[row] : self._name_offsets[row + 1]].decode()
+
+    def value(self, row: int, field: str, check_size=True):
+        if check_size and row >= self._size:
+            raise IndexError(row)
+        if field == "name":
+            return self.name(row)
+        if field == "seriesId":
+            series_id = self._series_ids[row]
+            return str(series_id) if series_id >= 0 else self._other_series_ids[row]
+        if field in self._interned:
+            return self._interned[field].value(self._codes[field][row])
+        raise KeyError(field)
+
+    def _found(self, row):
+        # Rows of an ongoing append are already indexed, but not yet part of the catalog
+        return ChannelRow(self, row) if row is not None and self.is_live(row) else None
+
+    def find(self, name: str, backend: str = None):
+        """Returns the channel with the given name, preferring the given backend if it exists in several."""
+        row = self._rows_by_name.get(name)
+        if row is not None and backend is not None and self.value(row, "backend", check_size=False) != backend:
+            row = self._rows_by_backend_and_name.get((backend, name), row)
+        return self._found(row)
+
+    @staticmethod
+    def _as_rows(rows):
+        return (rows,) if isinstance(rows, int) else rows
+
+    def find_by_series_id(self, series_id: str):
+        rows = self._rows_by_series_id.get(series_id_key(str(series_id)))
+        return self._found(None if rows is None else self._as_rows(rows)[0])
+
+    def _rows_of(self, backend, series_id, name):
+        rows = self._rows_by_series_id.get(series_id_key(series_id), ())
+        return [
+            row
+            for row in self._as_rows(rows)
+            if self.is_live(row) and self.value(row, "backend") == backend and self.name(row) == name
+        ]
+
+    def contains(self, channel) -> bool:
+        return bool(self._rows_of(*channel_key(normalize_channel(channel))))
+
+    def merge(self, channels) -> list[ChannelRow]:
+        """Appends all channels not yet in the catalog, identified by backend, seriesId and name."""
+        new_channels = {}
+        for channel in map(normalize_channel, channels):
+            key = channel_key(channel)
+            if key not in new_channels and not self.contains(channel):
+                new_channels[key] = channel
+        return self.append(new_channels.values())
+
+    def row(self, row: int) -> ChannelRow:
+        return ChannelRow(self, row)
+
+    def rows(self, rows=None) -> list[ChannelRow]:
+        if rows is None:
+            rows = range(self._size)
+        return [ChannelRow(self, row) for row in rows if self.is_live(row)]
+
+    def last_rows(self, count: int) -> list[int]:
+        """Returns the indices of the last count live rows, in row order."""
+        rows = []
+        row = self._size - 1
+        while row >= 0 and len(rows) < count:
+            if not self._removed[row]:
+                rows.append(row)
+            row -= 1
+        return rows[::-1]
+
+    def to_dicts(self, rows=None) -> list[dict]:
+        return [channel.to_dict() for channel in self.rows(rows)]
+
+    def search(self, search_text: str) -> list[ChannelRow]:
+        return self.rows(self.index.search(search_text))
+
+    def memory_footprint(self) -> dict:
+        columns = [*self._codes.values(), self._name_offsets, self._series_ids]
+        catalog_bytes = (
+            sum(sys.getsizeof(column) for column in columns)
+            + sys.getsizeof(self._names)
+            + sys.getsizeof(self._removed)
+            + deep_size(self._other_series_ids)
+            + sum(table.memory_footprint() for table in self._interned.values())
+        )
+        lookup_bytes = (
+            deep_size(self._rows_by_name)
+            + deep_size(self._rows_by_backend_and_name)
+            + deep_size(self._rows_by_series_id)
+        )
+        return {
+            "rows": len(self),
+            "removed_rows": self._removed_count,
+            "version": self.version,
+            "catalog_bytes": catalog_bytes,
+            "index_bytes": self.index.memory_footprint() + lookup_bytes,
+            "list_of_dicts_bytes": self.estimate_list_of_dicts_footprint(),
+            "interned_values": {field: len(table) for field, table in self._interned.items()},
+        }
+
+    def estimate_list_of_dicts_footprint(self, sample_size: int = 1000) -> int:
+        # Extrapolates from an evenly spread sample, measuring every row would take too long on large catalogs
+        if self._size == 0:
+            return sys.getsizeof([])
+        step = max(1, self._size // sample_size)
+        sample = range(0, self._size, step)
+        sample_bytes = sum(deep_size(self.row(row).to_dict()) for row in sample)
+        return sys.getsizeof([None] * self._size) + sample_bytes * self._size // len(sample)
@@ -0,0 +1,314 @@
+import bisect
+import functools
+import os
+import re
+import sys
+from array import array
+
+REGEX_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
+# Escapes that stand for a literal character rather than a character class or assertion
+LITERAL_ESCAPES = frozenset(".^$*+?{}[]\\|()-/ _:#")
+NGRAM_SIZE = 3
+COMPILED_PATTERN_CACHE_SIZE = int(os.getenv("COMPILED_PATTERN_CACHE_SIZE", 256))
+
+
+def is_plain_literal(search_text: str) -> bool:
+    return not any(char in REGEX_METACHARACTERS for char in search_text)
+
+
+@functools.lru_cache(maxsize=COMPILED_PATTERN_CACHE_SIZE)
+def compile_pattern(search_text: str) -> re.Pattern:
+    return re.compile(search_text, re.IGNORECASE)
+
+
+LITERAL, OPTIONAL, BREAK, END_ANCHOR = range(4)
+
+
+def tokenize_pattern(search_text: str, start: int):
+    """Yields (kind, value) tokens, reducing the regex to what matters for literal extraction."""
+    i = start
+    while i < len(search_text):
+        char = search_text[i]
+        if char == "\\":
+            escaped = search_text[i + 1 : i + 2]
+            yield (LITERAL, escaped) if escaped and escaped in LITERAL_ESCAPES else (BREAK, None)
+            i += 2
+        elif char == "[":
+            yield BREAK, None
+            i = skip_character_class(search_text, i)
+        elif char == "{":
+            yield OPTIONAL, None
+            closing = search_text.find("}", i)
+            i = closing + 1 if closing != -1 else len(search_text)
+        else:
+            if char in "?*":
+                yield OPTIONAL, None
+            elif char == "$" and i == len(search_text) - 1:
+                yield END_ANCHOR, None
+            elif char in ".^$+":
+                yield BREAK, None
+            else:
+                yield LITERAL, char
+            i += 1
+
+
+def parse_required_literals(search_text: str) -> tuple[str, str, list[str]]:
+    """
+    Extracts literal fragments every match of the given regex must contain.
+
+    Only handles the subset of regex syntax without groups and alternations, anything else yields no fragments
+    and therefore no narrowing. Returns the anchored prefix (if the pattern starts with ^), the anchored suffix
+    (if the pattern ends with $) and all literal fragments, all in lower case.
+    """
+    if "|" in search_text or "(" in search_text:
+        return "", "", []
+
+    anchored_start = search_text.startswith("^")
+    fragments = [""]
+    suffix = ""
+    for kind, value in tokenize_pattern(search_text, 1 if anchored_start else 0):
+        if kind == LITERAL:
+            fragments[-1] += value.lower()
+            continue
+        if kind == OPTIONAL:
+            # The preceding character may not be there at all, so it can't be part of a required fragment
+            fragments[-1] = fragments[-1][:-1]
+        elif kind == END_ANCHOR:
+            suffix = fragments[-1]
+        # A + keeps the preceding character required, but whatever follows doesn't have to be adjacent
+        fragments.append("")
+
+    prefix = fragments[0] if anchored_start else ""
+    return prefix, suffix, [fragment for fragment in fragments if fragment]
+
+
+def requires_literal(search_text: str, literal: str) -> bool:
+    """Whether every name matching the search text contains the given lower case literal."""
+    if is_plain_literal(search_text):
+        return literal in search_text.lower()
+    return any(literal in fragment for fragment in parse_required_literals(search_text)[2])
+
+
+def skip_character_class(search_text: str, start: int) -> int:
+    i = start + 1
+    if search_text[i : i + 1] == "^":
+        i += 1
+    # A closing bracket right at the start is part of the class
+    if search_text[i : i + 1] == "]":
+        i += 1
+    while i < len(search_text) and search_text[i] != "]":
+        i += 2 if search_text[i] == "\\" else 1
+    return i + 1
+
+
+def ngrams(text: str) -> set[str]:
+    return {text[i : i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+def prefix_upper_bound(prefix: str) -> str:
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class ChannelIndex:
+    """
+    Search index over channel names, answering the same queries as a case-insensitive re.search over every name.
+
+    Rows are identified by their position in the channel list the index was built from. Posting lists of name
+    trigrams and rows sorted by name/reversed name narrow the candidates down before a regex is evaluated.
+    Plain substring queries don't use the regex engine at all. Lowered names are kept in one contiguous string,
+    separated by newlines, instead of one string object per name.
+
+    Reads don't require any locking, rows added concurrently are simply not part of the result. Adding rows
+    has to be synchronized by the caller.
+    """
+
+    def __init__(self, names=()):
+        # Names as (blob, starts), row r spans blob[starts[r] : starts[r + 1] - 1]. Names and the rows sorted by
+        # name and reversed name are replaced together on every addition, so readers see a consistent snapshot
+        self._snapshot = (("", array("I", [0])), array("I"), array("I"))
+        self._postings = {}
+        self.add(names)
+
+    def __len__(self):
+        return len(self._snapshot[0][1]) - 1
+
+    def add(self, names):
+        (blob, starts), prefix_rows, suffix_rows = self._snapshot
+        start = len(starts) - 1
+        lowered = [str(name).lower().replace("\n", " ") for name in names]
+        if not lowered:
+            return
+
+        for row, name in enumerate(lowered, start):
+            for ngram in ngrams(name):
+                posting = self._postings.get(ngram)
+                if posting is None:
+                    posting = self._postings[ngram] = array("I")
+                posting.append(row)
+
+        new_starts = array("I", starts)
+        for name in lowered:
+            new_starts.append(new_starts[-1] + len(name) + 1)
+        new_names = (blob + "".join(f"{name}\n" for name in lowered), new_starts)
+
+        self._snapshot = (
+            new_names,
+            self._insert_sorted(new_names, prefix_rows, start, reverse=False),
+            self._insert_sorted(new_names, suffix_rows, start, reverse=True),
+        )
+
+    @staticmethod
+    def _name(names, row):
+        blob, starts = names
+        return blob[starts[row] : starts[row + 1] - 1]
+
+    @classmethod
+    def _sort_key(cls, names, reverse):
+        if reverse:
+            return lambda row: cls._name(names, row)[::-1]
+        return lambda row: cls._name(names, row)
+
+    @classmethod
+    def _insert_sorted(cls, names, sorted_rows, start, reverse):
+        size = len(names[1]) - 1
+        sort_key = cls._sort_key(names, reverse)
+        if size - start > start:
+            # Mostly new rows, sorting everything at once is cheaper than inserting one by one
+            all_names = names[0].split("\n", size)
+            if reverse:
+                all_names = [name[::-1] for name in all_names]
+            return array("I", sorted(range(size), key=all_names.__getitem__))
+        sorted_rows = array("I", sorted_rows)
+        for row in range(start, size):
+            sorted_rows.insert(bisect.bisect_right(sorted_rows, sort_key(row), key=sort_key), row)
+        return sorted_rows
+
+    def _range(self, names, sorted_rows, key, reverse):
+        sort_key = self._sort_key(names, reverse)
+        low = bisect.bisect_left(sorted_rows, key, key=sort_key)
+        high = bisect.bisect_left(sorted_rows, prefix_upper_bound(key), lo=low, key=sort_key)
+        return set(sorted_rows[low:high])
+
+    def _candidates(self, snapshot, prefix, suffix, fragments):
+        names, prefix_rows, suffix_rows = snapshot
+        size = len(names[1]) - 1
+        candidates = None
+        if prefix:
+            candidates = self._range(names, prefix_rows, prefix, reverse=False)
+        if suffix:
+            suffix_candidates = self._range(names, suffix_rows, suffix[::-1], reverse=True)
+            candidates = suffix_candidates if candidates is None else candidates & suffix_candidates
+
+        for fragment in fragments:
+            fragment_ngrams = ngrams(fragment)
+            if not fragment_ngrams:
+                continue
+            postings = sorted((self._postings.get(ngram, ()) for ngram in fragment_ngrams), key=len)
+            for posting in postings:
+                if candidates is None:
+                    candidates = {row for row in posting if row < size}
+                else:
+                    candidates.intersection_update(posting)
+                if not candidates:
+                    return []
+
+        if candidates is None:
+            return None
+        return sorted(candidates)
+
+    def _find_all(self, names, needle):
+        # Finds rows by scanning the contiguous names, which is a lot faster than checking each name on its own
+        blob, starts = names
+        rows = []
+        position = blob.find(needle)
+        while position != -1:
+            row = bisect.bisect_right(starts, position) - 1
+            rows.append(row)
+            position = blob.find(needle, starts[row + 1])
+        return rows
+
+    def search(self, search_text: str, rows=None) -> list[int]:
+        """
+        Returns the rows matching the search text, in ascending order.
+
+        If rows are given, only those are considered. They have to be sorted and contain all matches, e.g. be
+        the result of a search for a literal every match of the search text contains.
+        """
+        snapshot = self._snapshot
+        names = snapshot[0]
+        size = len(names[1]) - 1
+
+        if rows is not None:
+            return self._refine(names, search_text, rows)
+
+        if is_plain_literal(search_text):
+            needle = search_text.lower()
+            if "\n" in needle:
+                return []
+            candidates = self._candidates(snapshot, "", "", [needle])
+            if candidates is None:
+                return self._find_all(names, needle) if needle else list(range(size))
+            return [row for row in candidates if needle in self._name(names, row)]
+
+        prefix, suffix, fragments = parse_required_literals(search_text)
+        candidates = self._candidates(snapshot, prefix, suffix, fragments)
+        pattern = compile_pattern(search_text)
+        if candidates is None:
+            # Splitting all at once is much cheaper than slicing each name separately
+            all_names = names[0].split("\n", size)
+            return [row for row in range(size) if pattern.search(all_names[row])]
+        return [row for row in candidates if pattern.search(self._name(names, row))]
+
+    def _refine(self, names, search_text, rows):
+        if is_plain_literal(search_text):
+            needle = search_text.lower()
+            return [row for row in rows if needle in self._name(names, row)]
+        pattern = compile_pattern(search_text)
+        return [row for row in rows if pattern.search(self._name(names, row))]
+
+    def to_columns(self) -> dict:
+        """Returns the raw index structures, from_columns() turns them back into an equivalent index."""
+        (blob, starts), prefix_rows, suffix_rows = self._snapshot
+        ngram_keys = list(self._postings)
+        postings = array("I")
+        posting_offsets = array("Q", [0])
+        for ngram in ngram_keys:
+            postings.extend(self._postings[ngram])
+            posting_offsets.append(len(postings))
+        return {
+            "names": blob,
+            "starts": starts,
+            "prefix_rows": prefix_rows,
+            "suffix_rows": suffix_rows,
+            # All n-grams have the same length, so they can simply be concatenated
+            "ngrams": "".join(ngram_keys),
+            "postings": postings,
+            "posting_offsets": posting_offsets,
+        }
+
+    @classmethod
+    def from_columns(cls, columns: dict):
+        index = cls()
+        names = (columns["names"], columns["starts"])
+        size = len(names[1]) - 1
+        if len(columns["prefix_rows"]) != size or len(columns["suffix_rows"]) != size:
+            raise ValueError("Inconsistent index columns")
+        ngram_keys = columns["ngrams"]
+        postings = columns["postings"]
+        offsets = columns["posting_offsets"]
+        index._postings = {
+            ngram_keys[i * NGRAM_SIZE : (i + 1) * NGRAM_SIZE]: postings[offsets[i] : offsets[i + 1]]
+            for i in range(len(offsets) - 1)
+        }
+        index._snapshot = (names, columns["prefix_rows"], columns["suffix_rows"])
+        return index
+
+    def memory_footprint(self) -> int:
+        (blob, starts), prefix_rows, suffix_rows = self._snapshot
+        arrays = [starts, prefix_rows, suffix_rows, *self._postings.values()]
+        return (
+            sys.getsizeof(blob)
+            + sys.getsizeof(self._postings)
+            + sum(sys.getsizeof(key) for key in self._postings)
+            + sum(sys.getsizeof(values) for values in arrays)
+        )
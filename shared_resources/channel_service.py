@@ -1,68 +1,314 @@
+import base64
+import binascii
+import bisect
 import datetime
+import gzip
+import hashlib
+import heapq
 import logging
+import os
+import time
+from array import array
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from functools import partial
+from itertools import compress
+from operator import itemgetter
 from urllib.parse import urlencode
 
 import numpy as np
-from datahub import Daqbuf, Enum, Table, re
+import orjson
+from datahub import Daqbuf, Enum, Table
 
+from shared_resources.cancellation import RequestCancelled, cancellable, raise_if_cancelled, submit
+from shared_resources.channel_catalog import normalize_channel
+from shared_resources.channel_index import is_plain_literal, requires_literal
+from shared_resources.curve_stream import CurveChunkListener
+from shared_resources.downsampling import downsample_indices
+from shared_resources.session_pool import SessionPool
 from shared_resources.variables import SharedState
 
 logger = logging.getLogger("uvicorn")
 
+# Channel existence validation
+CHANNEL_EXISTENCE_POSITIVE_TTL_SECONDS = float(os.getenv("CHANNEL_EXISTENCE_POSITIVE_TTL_SECONDS", 3600))
+CHANNEL_EXISTENCE_NEGATIVE_TTL_SECONDS = float(os.getenv("CHANNEL_EXISTENCE_NEGATIVE_TTL_SECONDS", 60))
+CHANNEL_EXISTENCE_CACHE_SIZE = int(os.getenv("CHANNEL_EXISTENCE_CACHE_SIZE", 10_000))
 
-def search_channels(shared: SharedState, search_text=".*", allow_cached_response=True, backend=None):
+# Channel search result memoization, sized by the total number of cached result rows
+SEARCH_RESULT_CACHE_ROWS = int(os.getenv("SEARCH_RESULT_CACHE_ROWS", 1_000_000))
+
+# Curve caching, windows ending within the settle time may still receive data
+CURVE_CACHE_SETTLE_SECONDS = float(os.getenv("CURVE_CACHE_SETTLE_SECONDS", 300))
+CURVE_CACHE_LIVE_TTL_SECONDS = float(os.getenv("CURVE_CACHE_LIVE_TTL_SECONDS", 5))
+# Raw requests of windows touching the present refetch this much of the previous window, negative disables that
+LIVE_TAIL_OVERLAP_SECONDS = float(os.getenv("LIVE_TAIL_OVERLAP_SECONDS", 10))
+
+# Pooled Daqbuf sources per backend, and how long to wait for one if all are in use
+DAQBUF_POOL_SIZE = int(os.getenv("DAQBUF_POOL_SIZE", 16))
+DAQBUF_POOL_IDLE_SECONDS = float(os.getenv("DAQBUF_POOL_IDLE_SECONDS", 300))
+DAQBUF_POOL_TIMEOUT_SECONDS = float(os.getenv("DAQBUF_POOL_TIMEOUT_SECONDS", 30))
+DAQBUF_POOL_EXTRA_SIZE = int(os.getenv("DAQBUF_POOL_EXTRA_SIZE", 4))
+
+# Raw requests longer than RAW_SEGMENT_SECONDS are split at multiples of it, and the parts fetched in parallel
+RAW_SEGMENT_SECONDS = float(os.getenv("RAW_SEGMENT_SECONDS", 3600))
+
+# Planning raw or binned fetches for useEventsIfBinCountTooLarge, see plan_curve_fetch()
+EVENT_RATE_TTL_SECONDS = float(os.getenv("EVENT_RATE_TTL_SECONDS", 3600))
+EVENT_RATE_CACHE_SIZE = int(os.getenv("EVENT_RATE_CACHE_SIZE", 10_000))
+# Event estimates within this factor of the number of bins are verified with a count probe
+EVENT_RATE_MARGIN = float(os.getenv("EVENT_RATE_MARGIN", 2))
+
+# Streamed curve responses, events per chunk, chunks buffered per request and time limit of the whole response
+CURVE_STREAM_CHUNK_SIZE = int(os.getenv("CURVE_STREAM_CHUNK_SIZE", 10_000))
+CURVE_STREAM_QUEUE_SIZE = int(os.getenv("CURVE_STREAM_QUEUE_SIZE", 4))
+CURVE_STREAM_TIMEOUT_SECONDS = float(os.getenv("CURVE_STREAM_TIMEOUT_SECONDS", 300))
+
+# Batched curve requests, channels per Daqbuf query
+CURVE_BATCH_SIZE = int(os.getenv("CURVE_BATCH_SIZE", 50))
+
+COMPRESS_CHANNEL_CATALOG_RESPONSE = os.getenv("COMPRESS_CHANNEL_CATALOG_RESPONSE", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+    "on",
+)
+
+
+def search_channels(
+    shared: SharedState, search_text=".*", allow_cached_response=True, backend=None, materialize: bool = True
+):
+    """
+    Returns the channels matching the search text. Cached matches are ChannelRow views if not materialize,
+    leaving it to the caller to convert only those it hands out.
+    """
     matching_channels = []
     cache_miss = False
     if allow_cached_response:
-        with shared.available_backend_channels_lock:
-            cached_channel_list = list(shared.available_backend_channels)
-        for channel in cached_channel_list:
-            if re.search(search_text, channel["name"], re.IGNORECASE):
-                matching_channels.append(
-                    {
-                        "backend": str(channel.get("backend", "")),
-                        "name": str(channel.get("name", "")),
-                        "seriesId": str(channel.get("seriesId", "")),
-                        "source": str(channel.get("source", "")),
-                        "type": str(channel.get("type", "")),
-                        "shape": channel.get("shape", ""),  # May be []
-                        "unit": str(channel.get("unit", "")),
-                        "description": str(channel.get("description", "")),
-                    }
-                )
+        matching_channels = search_catalog(shared, search_text, backend)
+        if materialize:
+            matching_channels = [channel.to_dict() for channel in matching_channels]
         if not matching_channels:
             cache_miss = True
 
     if not matching_channels:
-        with Daqbuf(backend=backend, parallel=True) as source:
+        with daqbuf_session(shared, backend) as source:
             # Verbose gets us the plain response without any formatting, which would only slow everything down.
             source.verbose = True
             result = source.search(regex=search_text, case_sensitive=False)
             if result is not None:
-                matching_channels = [
-                    {
-                        "backend": str(channel.get("backend", "")),
-                        "name": str(channel.get("name", "")),
-                        "seriesId": str(channel.get("seriesId", "")),
-                        "source": str(channel.get("source", "")),
-                        "type": str(channel.get("type", "")),
-                        "shape": channel.get("shape", ""),  # May be []
-                        "unit": str(channel.get("unit", "")),
-                        "description": str(channel.get("description", "")),
-                    }
-                    for channel in result.get("channels", [])
-                ]
+                matching_channels = [normalize_channel(channel) for channel in result.get("channels", [])]
 
     # In case uncached channels were discovered, add them to the cache
     if matching_channels and cache_miss:
-        for channel in matching_channels:
-            if not any(channel == existing for existing in shared.available_backend_channels):
-                with shared.available_backend_channels_lock:
-                    shared.available_backend_channels.append(channel)
+        with shared.channel_catalog_lock:
+            shared.channel_catalog.merge(matching_channels)
 
     return matching_channels
 
 
+def is_idle_source(source) -> bool:
+    return not source.is_running() and not source.is_thread_running()
+
+
+def reset_source(source):
+    if not is_idle_source(source):
+        raise RuntimeError("Source is still running a query")
+    source.remove_listeners()
+    source.close_channels()
+    source.verbose = False
+
+
+@contextmanager
+def daqbuf_session(shared: SharedState, backend, wait: bool = True):
+    """
+    Borrows a Daqbuf source of the backend from its pool, to be used as context manager. Sources are reused,
+    sparing the setup of a new one per request. Code already holding a source borrows with wait=False.
+
+    The source is aborted if the request is cancelled, and a cancelled request gets no more sources.
+    """
+    raise_if_cancelled()
+    with shared.daqbuf_pools_lock:
+        pool = shared.daqbuf_pools.get(backend)
+        if pool is None:
+            pool = shared.daqbuf_pools[backend] = SessionPool(
+                partial(Daqbuf, backend=backend),
+                DAQBUF_POOL_SIZE,
+                DAQBUF_POOL_IDLE_SECONDS,
+                DAQBUF_POOL_TIMEOUT_SECONDS,
+                healthy=is_idle_source,
+                reset=reset_source,
+                max_extra=DAQBUF_POOL_EXTRA_SIZE,
+            )
+    with pool.session(wait) as source, cancellable(source):
+        yield source
+
+
+def search_catalog(shared: SharedState, search_text: str, backend=None) -> list:
+    """
+    Searches the channel catalog, memoizing the matching rows per search text, backend and catalog version.
+
+    A search text extending a cached plain literal is answered by filtering that literal's rows, instead of
+    searching the whole catalog.
+    """
+    catalog = shared.channel_catalog
+    version = catalog.version
+    key = (search_text, backend, version)
+    candidates = None
+    with shared.search_result_cache_lock:
+        cache = shared.search_result_cache
+        if cache["catalog"] is not catalog or cache["version"] != version:
+            # Results of any other catalog version are outdated
+            cache.update({"catalog": catalog, "version": version, "entries": {}, "rows": 0})
+        entries = cache["entries"]
+        rows = entries.pop(key, None)
+        if rows is not None:
+            # Dicts keep insertion order, reinserting marks the entry as the most recently used one
+            entries[key] = rows
+            cache["hits"] += 1
+            return catalog.rows(rows)
+        for length in range(len(search_text) - 1, 0, -1):
+            prefix = search_text[:length]
+            candidates = entries.get((prefix, backend, version))
+            if candidates is not None:
+                if is_plain_literal(prefix) and requires_literal(search_text, prefix.lower()):
+                    cache["refined"] += 1
+                    break
+                candidates = None
+        else:
+            cache["misses"] += 1
+
+    rows = array("I", catalog.index.search(search_text, candidates))
+    with shared.search_result_cache_lock:
+        cache = shared.search_result_cache
+        if cache["catalog"] is catalog and cache["version"] == version and len(rows) <= SEARCH_RESULT_CACHE_ROWS:
+            entries = cache["entries"]
+            cache["rows"] -= len(entries.pop(key, ()))
+            while entries and cache["rows"] + len(rows) > SEARCH_RESULT_CACHE_ROWS:
+                # Drops the least recently used entries until the new one fits
+                cache["rows"] -= len(entries.pop(next(iter(entries))))
+            entries[key] = rows
+            cache["rows"] += len(rows)
+    return catalog.rows(rows)
+
+
+def get_search_result_cache_stats(shared: SharedState) -> dict:
+    cache = shared.search_result_cache
+    return {
+        "entries": len(cache["entries"]),
+        "rows": cache["rows"],
+        "max_rows": SEARCH_RESULT_CACHE_ROWS,
+        "hits": cache["hits"],
+        "refined": cache["refined"],
+        "misses": cache["misses"],
+    }
+
+
+EXACT_MATCH, PREFIX_MATCH, SUBSTRING_MATCH, PATTERN_MATCH = range(4)
+
+
+def channel_rank_key(channel, search_text: str) -> tuple:
+    """Sort key ranking exact name matches first, then prefix, substring and finally regex matches."""
+    name = channel["name"]
+    lowered = name.lower()
+    needle = search_text.lower()
+    if lowered == needle:
+        rank = EXACT_MATCH
+    elif lowered.startswith(needle):
+        rank = PREFIX_MATCH
+    elif needle in lowered:
+        rank = SUBSTRING_MATCH
+    else:
+        rank = PATTERN_MATCH
+    # Shorter names are closer to what was searched for. The remaining fields make the order total.
+    return (rank, len(name), lowered, name, channel["backend"], str(channel["seriesId"]))
+
+
+def encode_search_cursor(search_text: str, rank_key: tuple) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps([search_text, *rank_key])).decode()
+
+
+def decode_search_cursor(search_text: str, cursor: str) -> tuple:
+    try:
+        cursor_search_text, *rank_key = orjson.loads(base64.urlsafe_b64decode(cursor))
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise ValueError("Malformed cursor") from None
+    if cursor_search_text != search_text or len(rank_key) != 6:
+        raise ValueError("Cursor does not belong to this search")
+    return tuple(rank_key)
+
+
+def rank_channels(channels, search_text: str, limit: int, cursor: str = None) -> tuple[list, str | None]:
+    """
+    Returns the page of the best ranked channels following the cursor, and the cursor of the next page.
+
+    Only the page is selected, using a heap bounded by the limit, so the matches are never sorted as a whole.
+    """
+    after = decode_search_cursor(search_text, cursor) if cursor else None
+    keyed = ((channel_rank_key(channel, search_text), i) for i, channel in enumerate(channels))
+    # One more than requested tells whether there is a next page
+    top = heapq.nsmallest(limit + 1, (entry for entry in keyed if after is None or entry[0] > after))
+    page = top[:limit]
+    next_cursor = encode_search_cursor(search_text, page[-1][0]) if len(top) > limit else None
+    return [channels[i] for _, i in page], next_cursor
+
+
+def get_catalog_response(shared: SharedState) -> dict:
+    """
+    Returns the response to a search for all channels, encoded once per catalog version.
+
+    The result holds the JSON body, its gzip compressed version (if enabled) and the ETag of both.
+    """
+    catalog = shared.channel_catalog
+    cached = shared.catalog_response
+    if cached is not None and cached["catalog"] is catalog and cached["version"] == catalog.version:
+        return cached
+
+    with shared.catalog_response_lock:
+        # Another request may have encoded it while waiting for the lock
+        cached = shared.catalog_response
+        if cached is not None and cached["catalog"] is catalog and cached["version"] == catalog.version:
+            return cached
+        # Taken before reading the rows, so concurrent changes lead to encoding again on the next request
+        version = catalog.version
+        body = orjson.dumps({"channels": catalog.to_dicts()})
+        etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        cached = {
+            "catalog": catalog,
+            "version": version,
+            "body": body,
+            "etag": f'"{etag}"',
+            "gzip_body": gzip.compress(body, compresslevel=6) if COMPRESS_CHANNEL_CATALOG_RESPONSE else None,
+            "gzip_etag": f'"{etag}-gzip"',
+        }
+        shared.catalog_response = cached
+        return cached
+
+
+def channel_exists(shared: SharedState, channel_name: str) -> bool:
+    channel_name = channel_name.strip()
+    if shared.channel_catalog.find(channel_name) is not None:
+        return True
+
+    now = time.monotonic()
+    with shared.channel_existence_cache_lock:
+        cached = shared.channel_existence_cache.get(channel_name)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+
+    # Unknown to the catalog and not validated recently, so ask the backend
+    exists = bool(search_channels(shared, channel_name))
+    ttl = CHANNEL_EXISTENCE_POSITIVE_TTL_SECONDS if exists else CHANNEL_EXISTENCE_NEGATIVE_TTL_SECONDS
+    with shared.channel_existence_cache_lock:
+        cache = shared.channel_existence_cache
+        cache.pop(channel_name, None)
+        while len(cache) >= CHANNEL_EXISTENCE_CACHE_SIZE:
+            # Dicts keep insertion order, so this drops the entry validated longest ago
+            del cache[next(iter(cache))]
+        cache[channel_name] = (exists, now + ttl)
+    return exists
+
+
 def get_numerical_value_and_description(value, isString) -> tuple[float, str]:
     numerical_value = 0
     description = None
@@ -141,6 +387,220 @@ def process_curve_data_waveform_entry(record, channel_name, curve):
     meta["pulseId"] = record.get("pulse_id")
 
 
+INTEGER_TYPES = (int, np.integer)
+NUMBER_TYPES = (int, float, np.bool_, np.integer, np.floating)
+
+
+def typed_column(column: list, types=NUMBER_TYPES, dtype=np.float64):
+    """Returns the values as an array, or None if not all of them are numbers of the given types."""
+    if not all(issubclass(value_type, types) for value_type in set(map(type, column))):
+        return None
+    try:
+        return np.fromiter(column, dtype=dtype, count=len(column))
+    except OverflowError:
+        return None
+
+
+def numeric_column(records, field, types=NUMBER_TYPES, dtype=np.float64):
+    """Returns the field of all records as an array, or None if not all of them are numbers of the given types."""
+    return typed_column(list(map(itemgetter(field), records)), types, dtype)
+
+
+def join_on_timestamps(timestamps, other_timestamps):
+    """
+    Returns for each timestamp the position of the row in other_timestamps with the same timestamp, and whether
+    there is such a row. For repeated timestamps, the last row wins, just like when building a dict of them.
+    """
+    order = np.argsort(other_timestamps, kind="stable")
+    sorted_timestamps = other_timestamps[order]
+    if len(sorted_timestamps) == 0:
+        return np.zeros(len(timestamps), dtype=np.intp), np.zeros(len(timestamps), dtype=bool)
+    positions = np.searchsorted(sorted_timestamps, timestamps, side="right") - 1
+    found = positions >= 0
+    positions[~found] = 0
+    found &= sorted_timestamps[positions] == timestamps
+    return order[positions], found
+
+
+def curve_columns(daqbuf_data, channel_name, remove_empty_bins, raw, isString=False, numeric_only=True):
+    """
+    Extracts the curve of the channel as NumPy columns, aligned to the value rows and without removed empty bins.
+
+    Values, min, max and count are aligned by joining on their timestamps, instead of by dict lookups. Min, max
+    and count are (values, found) pairs, as not every row has to have them. If numeric_only is set, None is
+    returned if the data contains anything but plain numbers, e.g. enums. Otherwise, such values are converted
+    one by one, and their descriptions are returned as well.
+    """
+    records = daqbuf_data.get(channel_name, [])
+    timestamps = numeric_column(records, "timestamp", INTEGER_TYPES, np.int64)
+    values = None if isString else numeric_column(records, channel_name)
+    descriptions = None
+    if (values is None or timestamps is None) and numeric_only:
+        return None
+    if timestamps is None:
+        timestamps = np.asarray([record["timestamp"] for record in records], dtype=object)
+    if values is None:
+        converted = [get_numerical_value_and_description(record[channel_name], isString) for record in records]
+        values = np.fromiter((value for value, _ in converted), dtype=np.float64, count=len(converted))
+        descriptions = [description for _, description in converted]
+
+    joined = {}
+    for suffix in ("min", "max", "count"):
+        name = f"{channel_name} {suffix}"
+        if name not in daqbuf_data:
+            continue
+        other_records = daqbuf_data[name]
+        other_timestamps = numeric_column(other_records, "timestamp", INTEGER_TYPES, np.int64)
+        other_values = numeric_column(other_records, name)
+        if other_values is None or other_timestamps is None:
+            return None
+        positions, found = join_on_timestamps(timestamps, other_timestamps)
+        # Nothing is found in an empty column, any value will do
+        joined[suffix] = (other_values[positions] if len(other_values) else np.zeros(len(positions)), found)
+    if "count" in joined:
+        counts, found = joined["count"]
+        joined["count"] = (counts.astype(np.int64), found)
+
+    keep = np.ones(len(records), dtype=bool)
+    if remove_empty_bins and not raw and "count" in joined:
+        counts, found = joined["count"]
+        keep &= ~(found & (counts == 0))
+    kept = keep.tolist()
+
+    return {
+        "timestamps": timestamps[keep],
+        "values": values[keep],
+        "descriptions": None if descriptions is None else list(compress(descriptions, kept)),
+        "pulse_ids": [record.get("pulse_id") for record in compress(records, kept)] if raw else None,
+        **{suffix: (other_values[keep], found[keep]) for suffix, (other_values, found) in joined.items()},
+    }
+
+
+def transform_curve_columns(daqbuf_data, channel_name, remove_empty_bins, raw, curve) -> bool:
+    """
+    Columnar version of the per record processing in transform_curve_data(), giving the same result.
+
+    Returns False without touching the curve if the data contains anything but plain numbers, e.g. enums.
+    """
+    columns = curve_columns(daqbuf_data, channel_name, remove_empty_bins, raw)
+    if columns is None:
+        return False
+
+    keys = list(map(str, columns["timestamps"].tolist()))
+    curve[channel_name] = dict(zip(keys, columns["values"].tolist(), strict=True))
+    for suffix in ("min", "max"):
+        if suffix in columns:
+            other_values, found = columns[suffix]
+            curve[f"{channel_name}_{suffix}"] = dict(
+                zip(list(compress(keys, found.tolist())), other_values[found].tolist(), strict=True)
+            )
+
+    if "count" in columns:
+        counts, found = columns["count"]
+        counts, found = counts.tolist(), found.tolist()
+    else:
+        counts, found = [0] * len(keys), [False] * len(keys)
+    if raw:
+        point_meta = [
+            {"count": count, "pulseId": pulse_id} if is_found else {"pulseId": pulse_id}
+            for count, is_found, pulse_id in zip(counts, found, columns["pulse_ids"], strict=True)
+        ]
+    else:
+        point_meta = [{"count": count} if is_found else {} for count, is_found in zip(counts, found, strict=True)]
+    curve[f"{channel_name}_meta"]["pointMeta"] = dict(zip(keys, point_meta, strict=True))
+    return True
+
+
+def dictionary_encode(descriptions) -> dict:
+    """Encodes the descriptions as the distinct ones and the index of each in those, -1 for no description."""
+    codes = {}
+    indices = np.fromiter(
+        (-1 if description is None else codes.setdefault(description, len(codes)) for description in descriptions),
+        dtype=np.int32,
+        count=len(descriptions),
+    )
+    return {"dictionary": list(codes), "indices": indices}
+
+
+def pulse_id_column(pulse_ids: list):
+    # Pulse ids may be missing, those can't be part of a typed array
+    typed_pulse_ids = typed_column(pulse_ids, INTEGER_TYPES, np.int64)
+    return pulse_ids if typed_pulse_ids is None else typed_pulse_ids
+
+
+def waveform_block(waveforms: list) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    Stacks the waveforms into one (events x samples) array, copying them row by row.
+
+    Waveforms of different lengths are padded with NaN, in which case the length of each is returned as well.
+    """
+    lengths = np.fromiter(map(len, waveforms), dtype=np.int64, count=len(waveforms))
+    if len(waveforms) == 0 or (lengths == lengths[0]).all():
+        return (np.stack(waveforms) if waveforms else np.zeros((0, 0))), None
+    block = np.full((len(waveforms), lengths.max()), np.nan)
+    for row, waveform in enumerate(waveforms):
+        block[row, : len(waveform)] = waveform
+    return block, lengths
+
+
+def transform_waveform_columnar(daqbuf_data, channel_name, raw=True):
+    """Returns the waveform curve as a timestamp and pulse id per event, and one block of all values."""
+    records = daqbuf_data.get(channel_name, [])
+    timestamps = numeric_column(records, "timestamp", INTEGER_TYPES, np.int64)
+    if timestamps is None:
+        timestamps = np.asarray([record["timestamp"] for record in records], dtype=object)
+    block, lengths = waveform_block(list(map(itemgetter(channel_name), records)))
+
+    curve = {"timestamps": timestamps, "values": block}
+    if lengths is not None:
+        curve["lengths"] = lengths
+    curve["pulseId"] = pulse_id_column([record.get("pulse_id") for record in records])
+
+    meta = {"raw": raw, "waveform": True, "format": "columnar"}
+    return {"curve": {channel_name: curve, f"{channel_name}_meta": meta}}
+
+
+def transform_curve_data_columnar(daqbuf_data, channel_name, remove_empty_bins=False, raw=True, isString=False):
+    """
+    Like transform_curve_data(), but returns the curve as parallel NumPy columns instead of dicts keyed by
+    timestamp, to be encoded by shared_resources.curve_encoding.
+
+    Min and max are NaN and count is -1 where a row has no matching bin. Waveforms are returned as one block of
+    (events x samples) values, see transform_waveform_columnar().
+    """
+    try:
+        is_waveform = is_waveform_entry(daqbuf_data[channel_name][0], channel_name)
+    except (KeyError, IndexError):
+        is_waveform = False
+    if is_waveform:
+        return transform_waveform_columnar(daqbuf_data, channel_name, raw)
+
+    columns = curve_columns(daqbuf_data, channel_name, remove_empty_bins, raw, isString, numeric_only=False)
+    if columns is None:
+        raise ValueError(f"Min, max or count of channel {channel_name} are not numeric")
+
+    curve = {"timestamps": columns["timestamps"], "values": columns["values"]}
+    for suffix, missing in (("min", np.nan), ("max", np.nan), ("count", -1)):
+        if suffix in columns:
+            values, found = columns[suffix]
+            curve[suffix] = np.where(found, values, missing)
+    if raw:
+        curve["pulseId"] = pulse_id_column(columns["pulse_ids"])
+    descriptions = columns["descriptions"]
+    if descriptions is not None and any(description is not None for description in descriptions):
+        curve["desc"] = dictionary_encode(descriptions)
+
+    intervals = np.diff(np.sort([r["timestamp"] for r in daqbuf_data.get(f"{channel_name} count", [])]))
+    meta = {
+        "raw": raw,
+        "waveform": False,
+        "format": "columnar",
+        "interval_avg": intervals.mean() if len(intervals) > 0 else 0,
+        "interval_stddev": intervals.std() if len(intervals) > 0 else 0,
+    }
+    return {"curve": {channel_name: curve, f"{channel_name}_meta": meta}}
+
+
 def transform_curve_data(daqbuf_data, channel_name, remove_empty_bins=False, raw=True, isString=False):
     count_name = f"{channel_name} count"
     min_name = f"{channel_name} min"
@@ -168,6 +628,16 @@ def transform_curve_data(daqbuf_data, channel_name, remove_empty_bins=False, raw
             )
         return {"curve": curve}
 
+    timestamps = np.sort([r["timestamp"] for r in daqbuf_data.get(count_name, [])])
+    intervals = np.diff(timestamps)
+
+    meta = curve.setdefault(f"{channel_name}_meta", {})
+    meta["interval_avg"] = intervals.mean() if len(intervals) > 0 else 0
+    meta["interval_stddev"] = intervals.std() if len(intervals) > 0 else 0
+
+    if not isString and transform_curve_columns(daqbuf_data, channel_name, remove_empty_bins, raw, curve):
+        return {"curve": curve}
+
     if min_name in daqbuf_data:
         curve[f"{channel_name}_min"] = {}
     if max_name in daqbuf_data:
@@ -178,13 +648,6 @@ def transform_curve_data(daqbuf_data, channel_name, remove_empty_bins=False, raw
     min_map = {str(r["timestamp"]): r for r in daqbuf_data.get(min_name, [])} if min_name in daqbuf_data else {}
     max_map = {str(r["timestamp"]): r for r in daqbuf_data.get(max_name, [])} if max_name in daqbuf_data else {}
 
-    timestamps = np.sort([r["timestamp"] for r in daqbuf_data.get(count_name, [])])
-    intervals = np.diff(timestamps)
-
-    meta = curve.setdefault(f"{channel_name}_meta", {})
-    meta["interval_avg"] = intervals.mean() if len(intervals) > 0 else 0
-    meta["interval_stddev"] = intervals.std() if len(intervals) > 0 else 0
-
     for record in daqbuf_data.get(channel_name, []):
         process_curve_data_entry(
             record,
@@ -214,6 +677,25 @@ def update_recent_channels(shared: SharedState, channel_entry: dict):
                 shared.recent_channels.pop()
 
 
+def cache_curve(shared: SharedState, key: tuple, curve: dict, end_time):
+    if is_settled(end_time):
+        shared.curve_cache.put(key, curve)
+    elif CURVE_CACHE_LIVE_TTL_SECONDS > 0:
+        shared.curve_cache.put(key, curve, ttl=CURVE_CACHE_LIVE_TTL_SECONDS)
+
+
+def quantize_live_window(begin_time, end_time) -> tuple:
+    """
+    Aligns the bounds of a window touching the present to CURVE_CACHE_LIVE_TTL_SECONDS, so concurrent live
+    requests, each ending at the time it was made, share a cache key and a fetch. The curve then lags the present
+    by at most as much as a cached live curve does. Windows shorter than that are left as they are.
+    """
+    step = int(CURVE_CACHE_LIVE_TTL_SECONDS * 1000)
+    if step <= 0 or end_time - begin_time < step or is_settled(end_time):
+        return begin_time, end_time
+    return begin_time - begin_time % step, end_time - end_time % step
+
+
 def get_curve_data(
     shared: SharedState,
     channel_name: str,
@@ -226,66 +708,672 @@ def get_curve_data(
     channel_entry: dict,
     timeout: int = -1,
     isString: bool = False,
+    columnar: bool = False,
+    max_points: int | None = None,
+    downsampling: str = "m4",
 ):
+    """
+    Returns the curve of the channel, from the curve cache if the same curve was requested before. Concurrent
+    requests of the same curve share one fetch.
+
+    Curves of windows that ended more than CURVE_CACHE_SETTLE_SECONDS ago are cached until evicted, as their data
+    won't change anymore. Curves of windows touching the present only for CURVE_CACHE_LIVE_TTL_SECONDS, their
+    bounds aligned to it.
+    """
     update_recent_channels(shared, channel_entry)
 
+    begin_time, end_time = quantize_live_window(begin_time, end_time)
+    key = curve_cache_key(
+        channel_name,
+        begin_time,
+        end_time,
+        backend,
+        num_bins,
+        useEventsIfBinCountTooLarge,
+        removeEmptyBins,
+        isString,
+        columnar,
+        max_points,
+        downsampling,
+    )
+    curve = shared.curve_cache.get(key)
+    if curve is not None:
+        return curve
+
+    def fetch_and_cache():
+        curve = fetch_curve_data(
+            shared,
+            channel_name,
+            begin_time,
+            end_time,
+            backend,
+            num_bins,
+            useEventsIfBinCountTooLarge,
+            removeEmptyBins,
+            timeout,
+            isString,
+            columnar,
+            max_points,
+            downsampling,
+        )
+        cache_curve(shared, key, curve, end_time)
+        return curve
+
+    # Identical requests arriving while the curve is fetched wait for that fetch instead of starting their own
+    while True:
+        try:
+            return shared.curve_flights.do(key, fetch_and_cache)
+        except RequestCancelled:
+            # The request fetching the curve may have been another one, then this one fetches it anew
+            raise_if_cancelled()
+
+
+def format_query_time(time_ms) -> str:
+    return datetime.datetime.fromtimestamp(time_ms / 1000, datetime.timezone.utc).isoformat(
+        sep=" ", timespec="milliseconds"
+    )
+
+
+def is_settled(end_time) -> bool:
+    """Whether a time window ending at the given time (ms) is not expected to receive any more data."""
+    return end_time < (time.time() - CURVE_CACHE_SETTLE_SECONDS) * 1000
+
+
+def request_data(source, query) -> dict:
+    table = Table()
+    source.add_listener(table)
+    source.request(query, background=True)
+    source.join()
+    source.remove_listeners()
+    return table.data
+
+
+def request_live_tail(
+    shared: SharedState, source, query, channel_name, backend, begin_time, end_time, namespace: str = "curve"
+) -> dict:
+    """
+    Requests the raw events of a window touching the present, only fetching what is new since the last request.
+    Windows are kept per namespace, so the live updates polls don't replace the windows of curve requests.
+
+    The events of the previous window of the channel are kept. If the new window starts within and ends after
+    it, only events from LIVE_TAIL_OVERLAP_SECONDS before its end on are fetched, to also pick up late arrivals.
+    Those replace the kept events from then on, and kept events before the new window are dropped.
+    """
+    key = (namespace, backend, channel_name)
+    window = shared.live_tail_cache.get(key)
+    if window is None or not window["begin"] <= begin_time <= window["end"] <= end_time:
+        daqbuf_data = request_data(source, query)
+        records = daqbuf_data.get(channel_name, []) if daqbuf_data else []
+    else:
+        delta_begin = max(window["end"] - LIVE_TAIL_OVERLAP_SECONDS * 1000, begin_time)
+        delta_data = request_data(source, {**query, "start": format_query_time(delta_begin)})
+        delta_begin_ns = int(delta_begin * 1_000_000)
+        # Events are in time order, so the kept ones can be sliced
+        kept = window["records"]
+        head = bisect.bisect_left(kept, int(begin_time * 1_000_000), key=itemgetter("timestamp"))
+        tail = bisect.bisect_left(kept, delta_begin_ns, key=itemgetter("timestamp"))
+        delta = [record for record in (delta_data or {}).get(channel_name, []) if record["timestamp"] >= delta_begin_ns]
+        records = kept[head:tail] + delta
+        daqbuf_data = {channel_name: records} if records else {}
+
+    shared.live_tail_cache.put(key, {"begin": begin_time, "end": end_time, "records": records})
+    return daqbuf_data
+
+
+def raw_segments(begin_time, end_time) -> list[tuple]:
+    """
+    Splits a time range (ms) longer than RAW_SEGMENT_SECONDS at multiples of it, returns the (begin, end) of the
+    parts. Shorter ranges are a single part, even if they cross a multiple.
+    """
+    length = int(RAW_SEGMENT_SECONDS * 1000)
+    if length <= 0 or end_time - begin_time <= length:
+        return [(begin_time, end_time)]
+    edges = [begin_time]
+    boundary = (begin_time // length + 1) * length
+    while boundary < end_time:
+        edges.append(boundary)
+        boundary += length
+    edges.append(end_time)
+    return list(zip(edges[:-1], edges[1:], strict=True))
+
+
+def request_raw_segment(shared: SharedState, query, channel_name, backend, begin_time, end_time) -> list:
+    """
+    Requests the raw events of one part of a split request. Whole parts that won't receive any more data are
+    cached on their own, so requests overlapping a previous one only fetch the parts not fetched before.
+    """
+    length = int(RAW_SEGMENT_SECONDS * 1000)
+    cacheable = begin_time % length == 0 and end_time - begin_time == length and is_settled(end_time)
+    key = (backend, channel_name, begin_time)
+    if cacheable:
+        records = shared.raw_segment_cache.get(key)
+        if records is not None:
+            return records
+
+    segment_query = {**query, "start": format_query_time(begin_time), "end": format_query_time(end_time)}
+    with daqbuf_session(shared, backend) as source:
+        records = (request_data(source, segment_query) or {}).get(channel_name, [])
+    if cacheable:
+        shared.raw_segment_cache.put(key, records)
+    return records
+
+
+def request_raw_segments(shared: SharedState, query, channel_name, backend, segments) -> dict:
+    """
+    Requests the raw events of the parts of a split request in parallel, and joins them in time order. The parts
+    of all requests share the threads of shared.raw_segment_executor.
+    """
+    parts = [
+        part.result()
+        for part in [
+            submit(shared.raw_segment_executor, request_raw_segment, shared, query, channel_name, backend, *segment)
+            for segment in segments
+        ]
+    ]
+
+    records = []
+    timestamp = itemgetter("timestamp")
+    for index, ((begin_time, end_time), part) in enumerate(zip(segments, parts, strict=True)):
+        # Events Daqbuf returns beyond a part are left to the adjacent part, so none is there twice
+        head = bisect.bisect_left(part, int(begin_time * 1_000_000), key=timestamp) if index > 0 else 0
+        tail = bisect.bisect_left(part, int(end_time * 1_000_000), key=timestamp) if index < len(parts) - 1 else None
+        records.extend(part[head:tail])
+    return {channel_name: records} if records else {}
+
+
+def fetch_live_events(shared: SharedState, backend, channel_name, begin_time, end_time) -> list:
+    """
+    Returns the raw events of the channel in the window, only fetching what is new, see request_live_tail(). With
+    a negative LIVE_TAIL_OVERLAP_SECONDS, the whole window is fetched.
+    """
+    query = {"channels": [channel_name], "start": format_query_time(begin_time), "end": format_query_time(end_time)}
+    with daqbuf_session(shared, backend) as source:
+        if LIVE_TAIL_OVERLAP_SECONDS >= 0:
+            daqbuf_data = request_live_tail(
+                shared, source, query, channel_name, backend, begin_time, end_time, namespace="live_updates"
+            )
+        else:
+            daqbuf_data = request_data(source, query) or {}
+    return daqbuf_data.get(channel_name, [])
+
+
+def transform_live_events(records, channel_name, isString=False, columnar=False) -> dict:
+    plan = {"raw": True, "reason": "requested"}
+    return transform_channel_data({channel_name: records}, channel_name, plan, False, isString, columnar)
+
+
+def count_events(daqbuf_data, channel_name) -> int | None:
+    """Returns the number of events in binned data, None if the data has no counts."""
+    count_key = f"{channel_name} count"
+    if count_key not in daqbuf_data:
+        return None
+    return int(sum(item.get(count_key, 0) for item in daqbuf_data[count_key]))
+
+
+def can_use_events(raw_data, channel_name) -> bool:
+    # Several waveforms can't be shown in place of bins
+    entries = raw_data.get(channel_name, [])
+    is_waveform = is_waveform_entry(entries[0], channel_name) if entries else False
+    return not is_waveform or len(entries) == 1
+
+
+def record_event_rate(shared: SharedState, backend, channel_name, events, begin_time, end_time, waveform=False):
+    duration = (end_time - begin_time) / 1000
+    if duration <= 0:
+        return
+    with shared.event_rate_cache_lock:
+        cache = shared.event_rate_cache
+        cache.pop((backend, channel_name), None)
+        while len(cache) >= EVENT_RATE_CACHE_SIZE:
+            # Dicts keep insertion order, so this drops the rate observed longest ago
+            del cache[next(iter(cache))]
+        cache[(backend, channel_name)] = (events / duration, waveform, time.monotonic() + EVENT_RATE_TTL_SECONDS)
+
+
+def cached_event_rate(shared: SharedState, backend, channel_name) -> tuple[float, bool] | None:
+    """Returns the last observed (events per second, waveform) of the channel, None if unknown or expired."""
+    with shared.event_rate_cache_lock:
+        cached = shared.event_rate_cache.get((backend, channel_name))
+    if cached is None or cached[2] <= time.monotonic():
+        return None
+    return cached[0], cached[1]
+
+
+def record_fetched_events(shared: SharedState, daqbuf_data, channel_name, backend, begin_time, end_time, raw):
+    if raw:
+        entries = daqbuf_data.get(channel_name, [])
+        waveform = bool(entries) and is_waveform_entry(entries[0], channel_name)
+        record_event_rate(shared, backend, channel_name, len(entries), begin_time, end_time, waveform)
+        return
+    events = count_events(daqbuf_data, channel_name)
+    if events is not None:
+        cached = cached_event_rate(shared, backend, channel_name)
+        record_event_rate(shared, backend, channel_name, events, begin_time, end_time, bool(cached and cached[1]))
+
+
+def plan_curve_fetch(shared: SharedState, channel_name, backend, begin_time, end_time, num_bins, useEvents) -> dict:
+    """
+    Decides up front whether to fetch raw events or bins, without fetching the bins first.
+
+    With useEventsIfBinCountTooLarge, events are used if there are fewer than bins (than two for waveforms,
+    several of which can't be shown in place of bins). Their number is estimated from the event rate of the
+    channel seen in earlier fetches. Without one, or with an estimate within EVENT_RATE_MARGIN of the threshold,
+    raw is None and the caller probes the count instead, see probe_plan().
+    """
+    if num_bins <= 0 or not useEvents:
+        return {"raw": num_bins <= 0, "reason": "requested"}
+    cached = cached_event_rate(shared, backend, channel_name)
+    if cached is None:
+        return {"raw": None, "reason": "probe"}
+    rate, waveform = cached
+    estimated_events = rate * (end_time - begin_time) / 1000
+    threshold = min(num_bins, 2) if waveform else num_bins
+    plan = {"raw": None, "reason": "probe", "estimated_events": round(estimated_events)}
+    if estimated_events * EVENT_RATE_MARGIN < threshold:
+        plan.update(raw=True, reason="event_rate")
+    elif estimated_events > threshold * EVENT_RATE_MARGIN:
+        plan.update(raw=False, reason="event_rate")
+    return plan
+
+
+def probe_plan(shared: SharedState, probe_data, channel_name, backend, begin_time, end_time, num_bins) -> dict:
+    """Completes a plan from a count probe, binned data of the time range with a single bin."""
+    events = count_events(probe_data, channel_name)
+    if events is None:
+        return {"raw": False, "reason": "probe"}
+    record_fetched_events(shared, probe_data, channel_name, backend, begin_time, end_time, raw=False)
+    return {"raw": events < num_bins, "reason": "probe", "events": events}
+
+
+def count_plan(shared: SharedState, plan: dict):
+    with shared.event_rate_cache_lock:
+        stats = shared.curve_plan_stats
+        stats[plan["reason"]] = stats.get(plan["reason"], 0) + 1
+
+
+def request_planned_data(shared: SharedState, query, channel_name, backend, begin_time, end_time, plan):
+    """
+    Fetches the data of one channel the way the plan says, returns it with the final plan. The pooled source is
+    given back before a split request, whose parts borrow their own.
+    """
+    num_bins = query.pop("bins", 0)
+    segments = raw_segments(begin_time, end_time)
+    with daqbuf_session(shared, backend) as source:
+        if plan["raw"] is None:
+            probe_data = request_data(source, {**query, "bins": 1}) or {}
+            plan = probe_plan(shared, probe_data, channel_name, backend, begin_time, end_time, num_bins)
+
+        live = LIVE_TAIL_OVERLAP_SECONDS >= 0 and not is_settled(end_time)
+        split = plan["raw"] and not live and len(segments) > 1
+        if not plan["raw"]:
+            daqbuf_data = request_data(source, {**query, "bins": num_bins})
+        elif live:
+            daqbuf_data = request_live_tail(shared, source, query, channel_name, backend, begin_time, end_time)
+        elif not split:
+            daqbuf_data = request_data(source, query)
+    if split:
+        daqbuf_data = request_raw_segments(shared, query, channel_name, backend, segments)
+
+    if daqbuf_data and plan["raw"] and plan["reason"] != "requested" and not can_use_events(daqbuf_data, channel_name):
+        record_fetched_events(shared, daqbuf_data, channel_name, backend, begin_time, end_time, raw=True)
+        plan = {"raw": False, "reason": "waveform"}
+        with daqbuf_session(shared, backend) as source:
+            daqbuf_data = request_data(source, {**query, "bins": num_bins})
+    return daqbuf_data, plan
+
+
+def fetch_curve_data(
+    shared: SharedState,
+    channel_name: str,
+    begin_time: int,
+    end_time: int,
+    backend: str,
+    num_bins: int,
+    useEventsIfBinCountTooLarge: bool,
+    removeEmptyBins: bool,
+    timeout: int = -1,
+    isString: bool = False,
+    columnar: bool = False,
+    max_points: int | None = None,
+    downsampling: str = "m4",
+):
     query = {
         "channels": [channel_name],
-        "start": datetime.datetime.fromtimestamp(begin_time / 1000, datetime.timezone.utc).isoformat(
-            sep=" ", timespec="milliseconds"
-        ),
-        "end": datetime.datetime.fromtimestamp(end_time / 1000, datetime.timezone.utc).isoformat(
-            sep=" ", timespec="milliseconds"
-        ),
+        "start": format_query_time(begin_time),
+        "end": format_query_time(end_time),
     }
 
-    raw = num_bins <= 0
-    if not raw:
+    if num_bins > 0:
         query["bins"] = num_bins
 
     if timeout > 0:
         query["timeout"] = timeout
 
-    curve = {}
+    plan = plan_curve_fetch(shared, channel_name, backend, begin_time, end_time, num_bins, useEventsIfBinCountTooLarge)
     try:
-        with Daqbuf(backend=backend) as source:
-            table = Table()
-            source.add_listener(table)
+        daqbuf_data, plan = request_planned_data(shared, query, channel_name, backend, begin_time, end_time, plan)
+        if useEventsIfBinCountTooLarge and daqbuf_data:
+            record_fetched_events(shared, daqbuf_data, channel_name, backend, begin_time, end_time, plan["raw"])
+        curve = transform_channel_data(
+            daqbuf_data, channel_name, plan, removeEmptyBins, isString, columnar, max_points, downsampling
+        )
+    except Exception as e:
+        logger.error(f"Error in fetch_curve_data: {e}")
+        raise RuntimeError from e
+    count_plan(shared, plan)
+    return curve
+
+
+def stream_curve_data(
+    shared: SharedState,
+    channel_name: str,
+    begin_time: int,
+    end_time: int,
+    backend: str,
+    num_bins: int,
+    useEventsIfBinCountTooLarge: bool,
+    removeEmptyBins: bool,
+    channel_entry: dict,
+    timeout: int = -1,
+    isString: bool = False,
+    columnar: bool = False,
+):
+    """
+    Yields the curve of the channel in parts of up to CURVE_STREAM_CHUNK_SIZE events, transformed as they arrive
+    instead of after the whole query. At most CURVE_STREAM_QUEUE_SIZE chunks are buffered, Daqbuf waits for the
+    consumer beyond that. Closing the generator aborts the query.
+
+    Streamed curves bypass the curve cache. Raw events are used as planned, without the waveform fallback.
+    """
+    update_recent_channels(shared, channel_entry)
+    query = {"channels": [channel_name], "start": format_query_time(begin_time), "end": format_query_time(end_time)}
+    if timeout > 0:
+        query["timeout"] = timeout
+    plan = plan_curve_fetch(shared, channel_name, backend, begin_time, end_time, num_bins, useEventsIfBinCountTooLarge)
+
+    listener = CurveChunkListener(CURVE_STREAM_CHUNK_SIZE, CURVE_STREAM_QUEUE_SIZE)
+    with daqbuf_session(shared, backend) as source:
+        try:
+            if plan["raw"] is None:
+                probe_data = request_data(source, {**query, "bins": 1}) or {}
+                plan = probe_plan(shared, probe_data, channel_name, backend, begin_time, end_time, num_bins)
+            if not plan["raw"]:
+                query["bins"] = num_bins
+            source.add_listener(listener)
             source.request(query, background=True)
+
+            empty = True
+            for chunk in listener.chunks(timeout if timeout > 0 else None):
+                empty = False
+                yield transform_channel_data(chunk, channel_name, plan, removeEmptyBins, isString, columnar)
+            if empty:
+                yield transform_channel_data({}, channel_name, plan, removeEmptyBins, isString, columnar)
+        except Exception as e:
+            logger.error(f"Error in stream_curve_data: {e}")
+            raise RuntimeError from e
+        finally:
+            # Unblocks the Daqbuf thread if the consumer stopped early
+            listener.close()
+            source.abort()
             source.join()
             source.remove_listeners()
-            daqbuf_data = table.data
-
-            if daqbuf_data is not None and len(daqbuf_data) > 0:
-                if not raw and useEventsIfBinCountTooLarge and channel_name + " count" in daqbuf_data:
-                    count_key = f"{channel_name} count"
-                    data_count = sum(item.get(count_key, 0) for item in daqbuf_data[count_key])
-
-                    if data_count < num_bins:
-                        table.clear()
-                        source.add_listener(table)
-                        query.pop("bins")
-                        source.request(query, background=True)
-                        source.join()
-                        source.remove_listeners()
-
-                        entries = table.data.get(channel_name, [])
-                        is_waveform = is_waveform_entry(entries[0], channel_name) if entries else False
-                        is_single_waveform = len(entries) == 1 and is_waveform
-
-                        if not is_waveform or is_single_waveform:
-                            raw = True
-                            daqbuf_data = table.data
-                curve = transform_curve_data(daqbuf_data, channel_name, removeEmptyBins, raw, isString)
-                table.clear()
-            else:
-                curve["curve"] = {channel_name: {}}
-    except Exception as e:
-        logger.error(f"Error in get_curve_data: {e}")
-        raise RuntimeError from e
+
+    if useEventsIfBinCountTooLarge and plan["raw"]:
+        record_event_rate(shared, backend, channel_name, listener.events, begin_time, end_time)
+    count_plan(shared, plan)
+
+
+def fetch_curve_batch(
+    shared: SharedState,
+    channel_names: list[str],
+    begin_time: int,
+    end_time: int,
+    backend: str,
+    num_bins: int,
+    useEventsIfBinCountTooLarge: bool,
+    timeout: int = -1,
+) -> dict:
+    """
+    Fetches the data of several channels of one backend, with one query for those the plan fetches as raw events
+    and one for those it fetches as bins. The counts of channels without a decisive plan are probed with one
+    query beforehand.
+
+    Returns channel name => (daqbuf data of the channel, plan), see plan_curve_fetch().
+    """
+    query = {"start": format_query_time(begin_time), "end": format_query_time(end_time)}
+    if timeout > 0:
+        query["timeout"] = timeout
+    plans = {
+        name: plan_curve_fetch(shared, name, backend, begin_time, end_time, num_bins, useEventsIfBinCountTooLarge)
+        for name in channel_names
+    }
+
+    channels = {}
+    with daqbuf_session(shared, backend) as source:
+        probed = [name for name, plan in plans.items() if plan["raw"] is None]
+        if probed:
+            probe_data = request_data(source, {**query, "channels": probed, "bins": 1}) or {}
+            for name in probed:
+                plans[name] = probe_plan(shared, probe_data, name, backend, begin_time, end_time, num_bins)
+
+        raw_names = [name for name, plan in plans.items() if plan["raw"]]
+        if raw_names:
+            raw_data = request_data(source, {**query, "channels": raw_names}) or {}
+            for name in raw_names:
+                data = channel_data(raw_data, name)
+                if plans[name]["reason"] == "requested" or can_use_events(data, name):
+                    channels[name] = (data, plans[name])
+                else:
+                    record_fetched_events(shared, data, name, backend, begin_time, end_time, raw=True)
+                    plans[name] = {"raw": False, "reason": "waveform"}
+
+        binned_names = [name for name in channel_names if name not in channels]
+        if binned_names:
+            binned_data = request_data(source, {**query, "channels": binned_names, "bins": num_bins}) or {}
+            channels.update((name, (channel_data(binned_data, name), plans[name])) for name in binned_names)
+
+    for name, (data, plan) in channels.items():
+        if useEventsIfBinCountTooLarge and data:
+            record_fetched_events(shared, data, name, backend, begin_time, end_time, plan["raw"])
+        count_plan(shared, plan)
+    return channels
+
+
+def channel_data(daqbuf_data, channel_name) -> dict:
+    names = (channel_name, f"{channel_name} count", f"{channel_name} min", f"{channel_name} max")
+    return {name: daqbuf_data[name] for name in names if name in daqbuf_data}
+
+
+def downsample_channel_data(daqbuf_data, channel_name, max_points, downsampling) -> tuple[dict, dict | None]:
+    """
+    Returns the raw data of the channel reduced to at most max_points events, with the meta of the downsampling,
+    or None if nothing was dropped. Enums, strings and waveforms are kept in full.
+    """
+    records = daqbuf_data.get(channel_name, [])
+    if len(records) <= max_points:
+        return daqbuf_data, None
+    timestamps = numeric_column(records, "timestamp", INTEGER_TYPES, np.int64)
+    values = numeric_column(records, channel_name)
+    if timestamps is None or values is None:
+        return daqbuf_data, None
+    indices = downsample_indices(timestamps, values, max_points, downsampling).tolist()
+    downsampled = {"method": downsampling, "events": len(records), "points": len(indices)}
+    return {**daqbuf_data, channel_name: list(map(records.__getitem__, indices))}, downsampled
+
+
+def transform_channel_data(
+    daqbuf_data, channel_name, plan, removeEmptyBins, isString, columnar, max_points=None, downsampling="m4"
+) -> dict:
+    raw = plan["raw"]
+    downsampled = None
+    if daqbuf_data and raw and max_points and not isString:
+        daqbuf_data, downsampled = downsample_channel_data(daqbuf_data, channel_name, max_points, downsampling)
+    if daqbuf_data:
+        transform = transform_curve_data_columnar if columnar else transform_curve_data
+        curve = transform(daqbuf_data, channel_name, removeEmptyBins, raw, isString)
+    elif columnar:
+        curve = transform_curve_data_columnar({}, channel_name, removeEmptyBins, raw, isString)
+    else:
+        curve = {"curve": {channel_name: {}}}
+    if plan["reason"] != "requested":
+        curve["curve"].setdefault(f"{channel_name}_meta", {})["plan"] = plan
+    if downsampled is not None:
+        curve["curve"][f"{channel_name}_meta"]["downsampled"] = downsampled
     return curve
 
 
+def curve_cache_key(
+    channel_name,
+    begin_time,
+    end_time,
+    backend,
+    num_bins,
+    useEventsIfBinCountTooLarge,
+    removeEmptyBins,
+    isString,
+    columnar,
+    max_points=None,
+    downsampling="m4",
+) -> tuple:
+    return (
+        backend,
+        channel_name,
+        begin_time,
+        end_time,
+        num_bins,
+        useEventsIfBinCountTooLarge,
+        removeEmptyBins,
+        bool(isString),
+        columnar,
+        (max_points, downsampling) if max_points else None,
+    )
+
+
+def batch_by_backend(channels: list) -> list[tuple[str, list]]:
+    """Splits (channel, cache key) pairs into batches of at most CURVE_BATCH_SIZE channels of the same backend."""
+    by_backend = {}
+    for channel, key in channels:
+        by_backend.setdefault(channel["backend"], []).append((channel, key))
+    return [
+        (backend, backend_channels[i : i + CURVE_BATCH_SIZE])
+        for backend, backend_channels in by_backend.items()
+        for i in range(0, len(backend_channels), CURVE_BATCH_SIZE)
+    ]
+
+
+def submit_transforms(executor, fetch, batch, pending, removeEmptyBins, columnar, max_points, downsampling):
+    """Submits the transformation of each channel of a fetched batch, yields the error if the fetch failed."""
+    try:
+        fetched = fetch.result()
+    except Exception as e:
+        logger.error(f"Error in fetch_curve_batch: {e}")
+        for channel, _ in batch:
+            yield channel, e
+        return
+    for channel, key in batch:
+        daqbuf_data, plan = fetched[channel["channel_name"]]
+        transform = submit(
+            executor,
+            transform_channel_data,
+            daqbuf_data,
+            channel["channel_name"],
+            plan,
+            removeEmptyBins,
+            channel["isString"],
+            columnar,
+            max_points,
+            downsampling,
+        )
+        pending[transform] = (channel, key)
+
+
+def get_curves(
+    shared: SharedState,
+    channels: list[dict],
+    begin_time: int,
+    end_time: int,
+    num_bins: int,
+    useEventsIfBinCountTooLarge: bool,
+    removeEmptyBins: bool,
+    timeout: int = -1,
+    columnar: bool = False,
+    max_points: int | None = None,
+    downsampling: str = "m4",
+):
+    """
+    Yields (channel, curve) for each of the channels, given as dicts of channel_name, backend and isString, in
+    the order they become ready. The curve is the exception instead if the channel could not be fetched.
+
+    Cached curves are yielded right away. The others are fetched with one query per backend and CURVE_BATCH_SIZE
+    channels, all queries in parallel, and each channel is transformed in parallel as soon as its query is done.
+    Queries and transformations of all requests share the threads of shared.curve_batch_executor.
+    """
+    begin_time, end_time = quantize_live_window(begin_time, end_time)
+    uncached = []
+    for channel in channels:
+        key = curve_cache_key(
+            channel["channel_name"],
+            begin_time,
+            end_time,
+            channel["backend"],
+            num_bins,
+            useEventsIfBinCountTooLarge,
+            removeEmptyBins,
+            channel["isString"],
+            columnar,
+            max_points,
+            downsampling,
+        )
+        curve = shared.curve_cache.get(key)
+        if curve is None:
+            uncached.append((channel, key))
+        else:
+            yield channel, curve
+
+    executor = shared.curve_batch_executor
+    # Future => batch for fetches, (channel, cache key) for transformations
+    pending = {}
+    try:
+        for backend, batch in batch_by_backend(uncached):
+            channel_names = list(dict.fromkeys(channel["channel_name"] for channel, _ in batch))
+            fetch = submit(
+                executor,
+                fetch_curve_batch,
+                shared,
+                channel_names,
+                begin_time,
+                end_time,
+                backend,
+                num_bins,
+                useEventsIfBinCountTooLarge,
+                timeout,
+            )
+            pending[fetch] = batch
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                if isinstance(item, list):
+                    yield from submit_transforms(
+                        executor, future, item, pending, removeEmptyBins, columnar, max_points, downsampling
+                    )
+                    continue
+                channel, key = item
+                try:
+                    curve = future.result()
+                except Exception as e:
+                    logger.error(f"Error transforming curve of {channel['channel_name']}: {e}")
+                    yield channel, e
+                    continue
+                cache_curve(shared, key, curve, end_time)
+                yield channel, curve
+    finally:
+        # The client went away, or a caller stopped early: drop the work not started yet
+        for future in pending:
+            future.cancel()
+
+
 def get_recent_channels(shared: SharedState):
     return shared.recent_channels
 
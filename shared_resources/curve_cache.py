@@ -0,0 +1,94 @@
+import sys
+import time
+from collections import OrderedDict
+from itertools import islice
+from threading import Lock
+
+import numpy as np
+
+
+def estimate_size(value, sample_size: int = 64) -> int:
+    """
+    Estimates the memory taken by a curve result in bytes.
+
+    NumPy arrays are measured exactly. Large dicts and lists are extrapolated from their first entries,
+    measuring every point of a curve would take about as long as transforming it.
+    """
+    if isinstance(value, np.ndarray):
+        return sys.getsizeof(value) if value.base is None else sys.getsizeof(value) + value.nbytes
+    if isinstance(value, dict):
+        sample = [estimate_size(key) + estimate_size(item) for key, item in islice(value.items(), sample_size)]
+    elif isinstance(value, (list, tuple)):
+        sample = [estimate_size(item) for item in islice(value, sample_size)]
+    else:
+        return sys.getsizeof(value)
+    return sys.getsizeof(value) + (sum(sample) * len(value) // len(sample) if sample else 0)
+
+
+class CurveCache:
+    """
+    LRU cache of curve results, bounded by their estimated total size in bytes.
+
+    Entries are stored with an optional time to live, entries without one never expire. Least recently used
+    entries are evicted once the size limit is reached, expired ones are dropped when they are looked up.
+    Thread safe, cached results are shared and must not be modified.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # Key => (value, size, expiry as time.monotonic() or None), least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, ttl: float = None):
+        size = estimate_size(value)
+        expiry = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            while self._entries and self._bytes + size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (value, size, expiry)
+            self._bytes += size
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,183 @@
+import cbor2
+import numpy as np
+import orjson
+
+try:
+    import pyarrow
+except ImportError:
+    # Arrow IPC responses are only offered if pyarrow is installed
+    pyarrow = None
+
+JSON_MEDIA_TYPE = "application/json"
+CBOR_MEDIA_TYPE = "application/cbor"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# RFC 8746 tags of little-endian typed arrays
+TYPED_ARRAY_TAGS = {
+    np.dtype("uint8"): 64,
+    np.dtype("<u2"): 69,
+    np.dtype("<u4"): 70,
+    np.dtype("<u8"): 71,
+    np.dtype("int8"): 72,
+    np.dtype("<i2"): 77,
+    np.dtype("<i4"): 78,
+    np.dtype("<i8"): 79,
+    np.dtype("<f2"): 84,
+    np.dtype("<f4"): 85,
+    np.dtype("<f8"): 86,
+}
+
+
+def supported_media_types() -> list[str]:
+    media_types = [JSON_MEDIA_TYPE, CBOR_MEDIA_TYPE]
+    if pyarrow is not None:
+        media_types.append(ARROW_STREAM_MEDIA_TYPE)
+    return media_types
+
+
+def quality_values(header: str) -> dict[str, float]:
+    """Parses an Accept style header into its lowercased entries and their q values, 1 where not given."""
+    qualities = {}
+    for entry in header.split(","):
+        value, *parameters = (part.strip() for part in entry.split(";"))
+        if not value:
+            continue
+        quality = 1.0
+        for parameter in parameters:
+            name, _, parameter_value = parameter.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(parameter_value)
+                except ValueError:
+                    quality = 0.0
+        qualities[value.lower()] = quality
+    return qualities
+
+
+def negotiate_media_type(accept: str) -> str | None:
+    """
+    Returns the supported media type the Accept header prefers, None if it accepts none of them.
+
+    Among media types with the same quality, an exact match wins over a wildcard one, and JSON over binary ones.
+    """
+    ranges = quality_values(accept)
+    if not ranges:
+        return JSON_MEDIA_TYPE
+
+    best, best_key = None, (0.0, 0)
+    for media_type in supported_media_types():
+        candidates = ((media_type, 2), (f"{media_type.split('/')[0]}/*", 1), ("*/*", 0))
+        # The most specific matching range decides about the quality
+        match = next(
+            ((ranges[media_range], specificity) for media_range, specificity in candidates if media_range in ranges),
+            None,
+        )
+        if match is not None and match[0] > 0 and match > best_key:
+            best, best_key = media_type, match
+    return best
+
+
+def columnar_channels(result: dict):
+    """Yields the names of the channels in the curve result that are in the columnar format."""
+    for name, meta in result["curve"].items():
+        if name.endswith("_meta") and meta.get("format") == "columnar":
+            yield name.removesuffix("_meta")
+
+
+def encode_json(result: dict) -> bytes:
+    # Timestamps are sent as strings to avoid precision loss in browsers
+    curve = dict(result["curve"])
+    for channel_name in columnar_channels(result):
+        curve[channel_name] = {
+            **curve[channel_name],
+            "timestamps": list(map(str, curve[channel_name]["timestamps"].tolist())),
+        }
+    return orjson.dumps({**result, "curve": curve}, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def to_cbor_value(value):
+    if isinstance(value, np.ndarray):
+        if value.dtype == np.bool_:
+            value = value.view(np.uint8)
+        tag = TYPED_ARRAY_TAGS.get(value.dtype.newbyteorder("<"))
+        if tag is None:
+            return value.tolist()
+        typed_array = cbor2.CBORTag(tag, np.ascontiguousarray(value, dtype=value.dtype.newbyteorder("<")).tobytes())
+        if value.ndim > 1:
+            # RFC 8746 multi-dimensional array in row-major order
+            return cbor2.CBORTag(40, [list(value.shape), typed_array])
+        return typed_array
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {key: to_cbor_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_cbor_value(item) for item in value]
+    return value
+
+
+def encode_cbor(result: dict) -> bytes:
+    """Encodes the curve result as CBOR, with NumPy arrays as RFC 8746 little-endian typed arrays."""
+    return cbor2.dumps(to_cbor_value(result))
+
+
+def arrow_values(curve: dict):
+    values = curve["values"]
+    if values.ndim == 1:
+        return pyarrow.array(values, pyarrow.float64())
+    # Waveforms, as one list of samples per event
+    lengths = curve.get("lengths")
+    if lengths is None:
+        return pyarrow.FixedSizeListArray.from_arrays(pyarrow.array(values.ravel()), values.shape[1])
+    samples = values[np.arange(values.shape[1]) < lengths[:, np.newaxis]]
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int32)
+    return pyarrow.ListArray.from_arrays(pyarrow.array(offsets), pyarrow.array(samples))
+
+
+def encode_arrow(result: dict) -> bytes:
+    """
+    Encodes a columnar curve result as Arrow IPC stream with one record batch.
+
+    Missing min, max, count and pulse ids are nulls, desc is a dictionary array and waveform values are lists.
+    The channel name and meta are stored in the schema metadata, the meta JSON encoded.
+    """
+    channel_name = next(columnar_channels(result), None)
+    if channel_name is None:
+        raise ValueError("Only columnar curves can be encoded as Arrow")
+    curve = result["curve"][channel_name]
+
+    columns = {
+        "timestamp": pyarrow.array(curve["timestamps"], pyarrow.int64()),
+        "value": arrow_values(curve),
+    }
+    for name in ("min", "max"):
+        if name in curve:
+            columns[name] = pyarrow.array(curve[name], pyarrow.float64(), mask=np.isnan(curve[name]))
+    if "count" in curve:
+        columns["count"] = pyarrow.array(curve["count"], pyarrow.int64(), mask=curve["count"] < 0)
+    if "pulseId" in curve:
+        columns["pulseId"] = pyarrow.array(curve["pulseId"], pyarrow.int64())
+    if "desc" in curve:
+        indices = curve["desc"]["indices"]
+        columns["desc"] = pyarrow.DictionaryArray.from_arrays(
+            pyarrow.array(indices, pyarrow.int32(), mask=indices < 0),
+            pyarrow.array(curve["desc"]["dictionary"], pyarrow.string()),
+        )
+
+    metadata = {
+        "channel": channel_name,
+        "meta": orjson.dumps(result["curve"][f"{channel_name}_meta"], option=orjson.OPT_SERIALIZE_NUMPY),
+    }
+    table = pyarrow.table(columns, metadata=metadata)
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_curve(result: dict, media_type: str) -> bytes:
+    if media_type == CBOR_MEDIA_TYPE:
+        return encode_cbor(result)
+    if media_type == ARROW_STREAM_MEDIA_TYPE:
+        return encode_arrow(result)
+    return encode_json(result)
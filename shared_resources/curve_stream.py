@@ -0,0 +1,78 @@
+from queue import Empty, Full, Queue
+from threading import Event
+
+from datahub import Consumer
+
+# Marks the end of the stream in the queue
+END_OF_STREAM = object()
+
+
+class CurveChunkListener(Consumer):
+    """
+    Daqbuf listener collecting the records of a query into chunks of up to chunk_size events per channel.
+
+    Chunks are in the format of Table.data and are put into a queue of at most max_chunks, blocking the Daqbuf
+    thread while it is full, so a slow consumer slows down the fetch instead of piling up records. Closing the
+    listener unblocks the Daqbuf thread and drops everything not consumed yet.
+    """
+
+    def __init__(self, chunk_size: int, max_chunks: int):
+        Consumer.__init__(self)
+        self.chunk_size = chunk_size
+        self.queue = Queue(maxsize=max_chunks)
+        self.closed = Event()
+        self.chunk = {}
+        self.binned = set()
+        self.events = 0
+
+    def on_channel_header(self, source, name, typ, byteOrder, shape, channel_compression, metadata):
+        if metadata.get("bins", None):
+            self.binned.add(name)
+
+    def on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs):
+        self.chunk.setdefault(name, []).append({"timestamp": timestamp, "pulse_id": pulse_id, name: value})
+        if name in self.binned:
+            for column in "max", "min", "count":
+                column_name = f"{name} {column}"
+                self.chunk.setdefault(column_name, []).append(
+                    {"timestamp": timestamp, "pulse_id": pulse_id, column_name: kwargs[column]}
+                )
+        self.events += 1
+        if len(self.chunk[name]) >= self.chunk_size:
+            self.flush()
+
+    def on_stop(self, source, exception):
+        self.flush()
+        self.put(END_OF_STREAM if exception is None else exception)
+
+    def on_close(self):
+        self.closed.set()
+
+    def flush(self):
+        if self.chunk:
+            chunk, self.chunk = self.chunk, {}
+            self.put(chunk)
+
+    def put(self, item):
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def chunks(self, timeout: float = None):
+        """
+        Yields the chunks as they arrive, until the query is done. Raises a RuntimeError if the query failed, or if
+        no chunk arrived for timeout seconds.
+        """
+        while True:
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Empty as e:
+                raise RuntimeError("No data received in time") from e
+            if item is END_OF_STREAM:
+                return
+            if isinstance(item, BaseException):
+                raise RuntimeError("Query failed") from item
+            yield item
@@ -1,35 +1,135 @@
 import logging
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 
+from datahub import Daqbuf
+
+from shared_resources.catalog_snapshot import save_catalog_snapshot
+from shared_resources.channel_catalog import channel_key
 from shared_resources.channel_service import search_channels
 from shared_resources.variables import SharedState
 
 logger = logging.getLogger("uvicorn")
 
+CHANNEL_SYNC_INTERVAL_SECONDS = float(os.getenv("CHANNEL_SYNC_INTERVAL_SECONDS", 3600))
+CHANNEL_SYNC_RETRY_SECONDS = float(os.getenv("CHANNEL_SYNC_RETRY_SECONDS", 30))
+# Per backend overrides of the sync interval, e.g. "sf-databuffer=600,sf-archiver=86400"
+CHANNEL_SYNC_INTERVALS = {
+    backend.strip(): float(seconds)
+    for backend, seconds in (
+        entry.split("=", 1) for entry in os.getenv("CHANNEL_SYNC_INTERVALS", "").split(",") if "=" in entry
+    )
+}
+# Backends to synchronize, all backends the data api knows about if empty
+CHANNEL_SYNC_BACKENDS = [
+    backend.strip() for backend in os.getenv("CHANNEL_SYNC_BACKENDS", "").split(",") if backend.strip()
+]
+# Once more than this fraction of the catalog rows are removed ones, the catalog is rebuilt without them
+CHANNEL_CATALOG_COMPACTION_RATIO = 0.25
+
+
+def sync_interval(backend: str) -> float:
+    return CHANNEL_SYNC_INTERVALS.get(backend, CHANNEL_SYNC_INTERVAL_SECONDS)
+
+
+def get_sync_backends(shared: SharedState) -> list[str]:
+    if CHANNEL_SYNC_BACKENDS:
+        return CHANNEL_SYNC_BACKENDS
+    with Daqbuf(backend=None) as source:
+        backends = source.get_backends()
+    if not backends:
+        # The backend list could not be fetched, keep syncing the backends already known
+        backends = sorted({channel["backend"] for channel in shared.channel_catalog.rows()})
+    return backends
+
+
+def sync_backend(shared: SharedState, backend: str) -> dict:
+    """Fetches all channels of the backend and applies the difference to the channel catalog."""
+    start = time.perf_counter()
+    fetched = {
+        channel_key(channel): channel
+        for channel in search_channels(shared, allow_cached_response=False, backend=backend)
+        if channel["backend"] == backend
+    }
+    current = shared.channel_catalog.keys(backend)
+    if not fetched and current:
+        # Rather an outage than a backend that lost all of its channels
+        raise RuntimeError(f"No channels received for backend {backend}")
+
+    added = [channel for key, channel in fetched.items() if key not in current]
+    removed = current - fetched.keys()
+    with shared.channel_catalog_lock:
+        catalog = shared.channel_catalog
+        catalog.remove(removed)
+        catalog.merge(added)
+        if catalog.removed_count > len(catalog) * CHANNEL_CATALOG_COMPACTION_RATIO:
+            shared.channel_catalog = catalog.compacted()
+
+    return {
+        "last_sync": time.time(),
+        "duration_seconds": time.perf_counter() - start,
+        "channels": len(fetched),
+        "added": len(added),
+        "removed": len(removed),
+        "error": None,
+    }
+
 
-def cache_backend_channels(shared: SharedState):
-    if shared.backend_sync_active:
-        return
-    shared.backend_sync_active = True
+def sync_backend_and_record(shared: SharedState, backend: str) -> bool:
+    stats = shared.backend_sync_stats.get(backend, {"syncs": 0, "failures": 0})
+    try:
+        stats.update(sync_backend(shared, backend))
+        stats["syncs"] += 1
+        next_sync = time.time() + sync_interval(backend)
+        logger.info(
+            f"Synchronized backend {backend} in {stats['duration_seconds']:.1f} s: {stats['channels']} channels, "
+            f"{stats['added']} added, {stats['removed']} removed."
+        )
+    except Exception as e:
+        stats.update({"last_sync": time.time(), "error": str(e)})
+        stats["failures"] += 1
+        next_sync = time.time() + CHANNEL_SYNC_RETRY_SECONDS
+        logger.error(f"Could not synchronize backend {backend}: {e}")
+    stats.update({"interval_seconds": sync_interval(backend), "next_sync": next_sync})
+    shared.backend_sync_stats[backend] = stats
+    return stats["error"] is None and (stats["added"] > 0 or stats["removed"] > 0)
 
-    backend_channels = search_channels(shared, allow_cached_response=False)
 
-    with shared.available_backend_channels_lock:
-        shared.available_backend_channels = backend_channels
+def cache_backend_channels(shared: SharedState, backends: list[str] = None):
+    """Synchronizes the given backends, or all of them, in parallel."""
+    with shared.backend_sync_lock:
+        if backends is None:
+            backends = get_sync_backends(shared)
+        if not backends:
+            return
+        with ThreadPoolExecutor(max_workers=len(backends)) as executor:
+            changed = list(executor.map(lambda backend: sync_backend_and_record(shared, backend), backends))
+        if any(changed):
+            save_catalog_snapshot(shared, shared.channel_catalog)
 
-    # In case there are no recent channels, take the last ten of the ones just fetched
-    if len(shared.recent_channels) == 0:
-        with shared.recent_channels_lock:
-            shared.recent_channels = backend_channels[-10:]
-    shared.backend_sync_active = False
+        # In case there are no recent channels, take the last ten of the ones known
+        if len(shared.recent_channels) == 0:
+            with shared.recent_channels_lock:
+                catalog = shared.channel_catalog
+                shared.recent_channels = catalog.to_dicts(catalog.last_rows(10))
 
 
 def backend_synchronizer(shared: SharedState):
-    one_week_in_seconds = 604_800
     while True:
         try:
-            cache_backend_channels(shared)
-            time.sleep(one_week_in_seconds)
+            # Backends are looked up every round, so new ones are picked up without a restart
+            backends = get_sync_backends(shared)
+            now = time.time()
+            due = [
+                backend for backend in backends if shared.backend_sync_stats.get(backend, {}).get("next_sync", 0) <= now
+            ]
+            cache_backend_channels(shared, due)
+            next_sync = min(
+                (shared.backend_sync_stats.get(backend, {}).get("next_sync", now) for backend in backends),
+                default=now + CHANNEL_SYNC_INTERVAL_SECONDS,
+            )
+            time.sleep(max(next_sync - time.time(), CHANNEL_SYNC_RETRY_SECONDS))
         except Exception as e:
             logger.error(f"Error in backend_synchronizer: {e}")
-            time.sleep(30)
+            time.sleep(CHANNEL_SYNC_RETRY_SECONDS)
@@ -1,21 +1,98 @@
 import asyncio
-from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial, wraps
+from os import getenv
+from threading import Lock
 
 from fastapi import HTTPException
 
+from shared_resources.cancellation import CancellationToken, current_token
 
-def timeout(limit: float):
+# Threads per route class: "fast" routes only touch memory or MongoDB, "data" routes query the archivers
+EXECUTOR_WORKERS = {
+    "fast": int(getenv("FAST_EXECUTOR_WORKERS", 16)),
+    "data": int(getenv("DATA_EXECUTOR_WORKERS", 32)),
+}
+
+# Returned by next() once a streamed iterator is exhausted
+END_OF_ITERATION = object()
+
+_executors = {}
+_executor_stats = {
+    executor: {"queued": 0, "running": 0, "completed": 0, "streams": 0, "timed_out": 0, "cancelled": 0}
+    for executor in EXECUTOR_WORKERS
+}
+_executors_lock = Lock()
+
+
+def get_executor(executor: str) -> ThreadPoolExecutor:
+    with _executors_lock:
+        if executor not in _executors:
+            _executors[executor] = ThreadPoolExecutor(
+                max_workers=EXECUTOR_WORKERS[executor], thread_name_prefix=f"{executor}-route"
+            )
+        return _executors[executor]
+
+
+def count(executor: str, stat: str, increment: int = 1):
+    with _executors_lock:
+        _executor_stats[executor][stat] += increment
+
+
+def run_with_token(executor: str, token: CancellationToken, func):
+    count(executor, "queued", -1)
+    count(executor, "running")
+    try:
+        current_token.set(token)
+        return func()
+    finally:
+        count(executor, "running", -1)
+        count(executor, "completed")
+
+
+def submit_call(executor: str, token: CancellationToken, func, *args):
+    """Submits func(*args) to the executor of the route class, to run with token as the request's token."""
+    pool = get_executor(executor)
+    count(executor, "queued")
+    return pool.submit(copy_context().run, partial(run_with_token, executor, token, partial(func, *args)))
+
+
+async def run_in_executor(executor: str, token: CancellationToken, func, *args):
+    return await asyncio.wrap_future(submit_call(executor, token, func, *args))
+
+
+def executor_stats() -> dict:
+    with _executors_lock:
+        return {
+            executor: {"workers": EXECUTOR_WORKERS[executor], **stats} for executor, stats in _executor_stats.items()
+        }
+
+
+def cancel(executor: str, token: CancellationToken, future, stat: str, reason: str):
+    token.cancel(reason)
+    count(executor, stat)
+    # Succeeds if the call was still waiting for a thread
+    if future is not None and future.cancel():
+        count(executor, "queued", -1)
+
+
+def timeout(limit: float, executor: str = "fast"):
     """
-    A decorator that runs a function in a separate thread using asyncio.to_thread().
+    A decorator that runs a function in a thread of the executor of its route class.
 
-    If the function execution exceeds the specified time limit (in seconds), it will be
-    terminated and an HTTP 504 Timeout error will be raised.
+    If the function execution exceeds the specified time limit (in seconds), or the client goes away, the
+    request is cancelled: the Daqbuf queries it runs are aborted and, for a timeout, an HTTP 504 Timeout error
+    is raised. A call still waiting for a thread then never starts.
 
     This decorator is designed for blocking (synchronous) functions only and will not
     work as expected with asynchronous functions (i.e., functions defined with `async def`).
+    Responses streamed after the function returned are to be iterated with stream().
 
     Args:
         limit (float): The time limit in seconds for the function execution.
+        executor (str): The route class, "fast" for memory and MongoDB work, "data" for archiver queries. Each
+            class has its own threads, so slow data requests can't hold up fast ones.
 
     Returns:
         The result of the function if it completes within the time limit.
@@ -27,12 +104,73 @@ def timeout(limit: float):
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
+            token = CancellationToken()
+            future = submit_call(executor, token, partial(func, *args, **kwargs))
             try:
-                result = await asyncio.wait_for(asyncio.to_thread(func, *args, **kwargs), timeout=limit)
+                result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=limit)
                 return result
             except asyncio.TimeoutError:
+                cancel(executor, token, future, "timed_out", "Request timed out")
                 raise HTTPException(status_code=504, detail="Request timed out") from None
+            except asyncio.CancelledError:
+                cancel(executor, token, future, "cancelled", "Request cancelled")
+                raise
 
         return wrapper
 
     return decorator
+
+
+def close_iterator(executor: str, token: CancellationToken, iterator, step):
+    """Closes the iterator in a thread of the executor once its running step, if any, is done."""
+
+    def close(_=None):
+        submit_call(executor, token, iterator.close)
+
+    if step is None:
+        close()
+    elif step.cancel():
+        # The step never ran
+        count(executor, "queued", -1)
+        close()
+    else:
+        step.add_done_callback(close)
+
+
+async def stream(iterator, limit: float, executor: str = "data"):
+    """
+    Iterates a blocking iterator, e.g. the body of a StreamingResponse, in threads of the executor of its route
+    class, one item per call and with the token of the stream as the request's token.
+
+    Past limit seconds, the stream is cancelled like a timed out call, aborting its Daqbuf queries. The iterator
+    is still iterated to its end then, so it can report the error, e.g. in a last frame. If the client goes away,
+    the stream is cancelled as well and the iterator closed.
+    """
+    token = CancellationToken()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + limit
+    step = None
+    count(executor, "streams")
+    try:
+        while True:
+            step = submit_call(executor, token, next, iterator, END_OF_ITERATION)
+            result = asyncio.wrap_future(step)
+            if token.cancelled:
+                item = await result
+            else:
+                try:
+                    item = await asyncio.wait_for(asyncio.shield(result), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    cancel(executor, token, None, "timed_out", "Request timed out")
+                    item = await result
+            step = None
+            if item is END_OF_ITERATION:
+                return
+            yield item
+    except (asyncio.CancelledError, GeneratorExit):
+        if not token.cancelled:
+            cancel(executor, token, None, "cancelled", "Request cancelled")
+        close_iterator(executor, token, iterator, step)
+        raise
+    finally:
+        count(executor, "streams", -1)
@@ -0,0 +1,71 @@
+import numpy as np
+
+DOWNSAMPLING_METHODS = ("m4", "lttb")
+
+
+def m4_indices(timestamps: np.ndarray, values: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Returns the indices of the events M4 keeps: the first, last, minimum and maximum event of each of
+    max_points / 4 buckets of equal time width. Drawn as a line, they give the same pixels as all events.
+
+    The timestamps must be sorted.
+    """
+    buckets = max(max_points // 4, 1)
+    offsets = (timestamps - timestamps[0]).astype(np.float64)
+    span = offsets[-1]
+    if span > 0:
+        bucket = np.minimum((offsets * (buckets / span)).astype(np.int64), buckets - 1)
+    else:
+        bucket = np.zeros(len(timestamps), dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+    ends = np.concatenate((starts[1:], [len(timestamps)])) - 1
+    lengths = ends - starts + 1
+    extremes = [
+        first_per_bucket(np.flatnonzero(values == np.repeat(reduce.reduceat(values, starts), lengths)), bucket)
+        for reduce in (np.fmin, np.fmax)
+    ]
+    return np.unique(np.concatenate((starts, ends, *extremes)))
+
+
+def first_per_bucket(indices: np.ndarray, bucket: np.ndarray) -> np.ndarray:
+    """Returns the first of the sorted indices in each bucket."""
+    buckets = bucket[indices]
+    return indices[np.concatenate(([True], buckets[1:] != buckets[:-1]))] if len(indices) else indices
+
+
+def lttb_indices(timestamps: np.ndarray, values: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Returns the indices of the events Largest-Triangle-Three-Buckets keeps: the first and last event, and of each
+    of max_points - 2 buckets of equal event count the one forming the largest triangle with the event kept
+    before it and the average of the next bucket.
+
+    Each bucket depends on the event kept before it, so the buckets are processed one by one, each vectorized.
+    """
+    length = len(timestamps)
+    x = (timestamps - timestamps[0]).astype(np.float64)
+    y = values.astype(np.float64)
+    edges = np.linspace(1, length - 1, max_points - 1).astype(np.int64)
+    # The last bucket is followed by the last event
+    next_edges = np.append(edges[2:], length)
+
+    indices = np.empty(max_points, dtype=np.int64)
+    indices[0], indices[-1] = 0, length - 1
+    kept = 0
+    for bucket, (start, end) in enumerate(zip(edges[:-1].tolist(), edges[1:].tolist(), strict=True)):
+        next_end = next_edges[bucket]
+        average_x, average_y = x[end:next_end].mean(), y[end:next_end].mean()
+        areas = np.abs(
+            (x[kept] - average_x) * (y[start:end] - y[kept]) - (x[kept] - x[start:end]) * (average_y - y[kept])
+        )
+        kept = start + int(np.argmax(np.nan_to_num(areas, nan=-1.0)))
+        indices[bucket + 1] = kept
+    return indices
+
+
+def downsample_indices(timestamps: np.ndarray, values: np.ndarray, max_points: int, method: str = "m4"):
+    """Returns the indices of the events to keep to draw at most max_points, None if all are needed."""
+    if len(timestamps) <= max_points:
+        return None
+    if method == "lttb":
+        return lttb_indices(timestamps, values, max_points)
+    return m4_indices(timestamps, values, max_points)
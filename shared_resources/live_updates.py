@@ -0,0 +1,127 @@
+import asyncio
+import bisect
+import logging
+import time
+from operator import itemgetter
+from os import getenv
+
+from shared_resources.cancellation import CancellationToken
+from shared_resources.decorators import run_in_executor
+
+logger = logging.getLogger("uvicorn")
+
+# Live channels are polled this often, each time for the events of the last LIVE_WINDOW_SECONDS
+LIVE_POLL_INTERVAL_SECONDS = float(getenv("LIVE_POLL_INTERVAL_SECONDS", 1))
+LIVE_WINDOW_SECONDS = float(getenv("LIVE_WINDOW_SECONDS", 60))
+
+
+class LiveChannel:
+    """A polled channel, with the events of its current window and the subscribers to notify of new ones."""
+
+    def __init__(self, backend: str, channel_name: str):
+        self.backend = backend
+        self.channel_name = channel_name
+        # Events of the last LIVE_WINDOW_SECONDS, in time order
+        self.records = []
+        self.subscribers = set()
+        self.task = None
+        # Cancelled once the last subscriber is gone, aborting a running poll
+        self.token = CancellationToken()
+
+
+class LiveSubscriber:
+    """
+    A client subscribed to live channels, remembering per channel the timestamp of the last event it was sent.
+
+    Notifications only set a flag, so a client busy receiving gets the events of all polls it missed in a single
+    frame per channel once it is ready again, instead of a queue of frames piling up.
+    """
+
+    def __init__(self):
+        self.changed = asyncio.Event()
+        # (backend, channel name) => (isString, timestamp of the last event sent or None)
+        self.channels = {}
+
+    def notify(self):
+        self.changed.set()
+
+    def deltas(self, hub: "LiveHub"):
+        """Yields (backend, channel name, isString, events not sent yet) for each channel with new events."""
+        for key, (isString, sent) in list(self.channels.items()):
+            channel = hub.channels.get(key)
+            if channel is None or not channel.records:
+                continue
+            records = channel.records
+            start = 0 if sent is None else bisect.bisect_right(records, sent, key=itemgetter("timestamp"))
+            if start < len(records):
+                self.channels[key] = (isString, records[-1]["timestamp"])
+                yield *key, isString, records[start:]
+
+
+class LiveHub:
+    """
+    Polls each subscribed channel once, no matter how many clients subscribed to it, and notifies the subscribers.
+
+    Polling of a channel starts with its first subscriber and stops with its last. Must be used from the event
+    loop only, fetches run in threads of the "data" route executor.
+    """
+
+    def __init__(self):
+        # (backend, channel name) => LiveChannel
+        self.channels = {}
+        self.polls = 0
+        self.errors = 0
+
+    def subscribe(self, subscriber: LiveSubscriber, backend: str, channel_name: str, isString: bool, fetch):
+        """Subscribes to the channel, fetch(backend, channel_name, begin_time, end_time) returns its events."""
+        key = (backend, channel_name)
+        if key in subscriber.channels:
+            return
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = self.channels[key] = LiveChannel(backend, channel_name)
+            channel.task = asyncio.create_task(self.poll(channel, fetch))
+        channel.subscribers.add(subscriber)
+        subscriber.channels[key] = (isString, None)
+        if channel.records:
+            subscriber.notify()
+
+    def unsubscribe(self, subscriber: LiveSubscriber, backend: str, channel_name: str):
+        key = (backend, channel_name)
+        subscriber.channels.pop(key, None)
+        channel = self.channels.get(key)
+        if channel is None:
+            return
+        channel.subscribers.discard(subscriber)
+        if not channel.subscribers:
+            channel.task.cancel()
+            channel.token.cancel()
+            del self.channels[key]
+
+    def unsubscribe_all(self, subscriber: LiveSubscriber):
+        for backend, channel_name in list(subscriber.channels):
+            self.unsubscribe(subscriber, backend, channel_name)
+
+    async def poll(self, channel: LiveChannel, fetch):
+        while True:
+            end_time = time.time() * 1000
+            begin_time = end_time - LIVE_WINDOW_SECONDS * 1000
+            try:
+                channel.records = await run_in_executor(
+                    "data", channel.token, fetch, channel.backend, channel.channel_name, begin_time, end_time
+                )
+                self.polls += 1
+            except Exception as e:
+                logger.error(f"Error polling live channel {channel.channel_name}: {e}")
+                self.errors += 1
+            for subscriber in channel.subscribers:
+                subscriber.notify()
+            await asyncio.sleep(LIVE_POLL_INTERVAL_SECONDS)
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self.channels),
+            "subscriptions": sum(len(channel.subscribers) for channel in self.channels.values()),
+            "polls": self.polls,
+            "errors": self.errors,
+        }
@@ -0,0 +1,206 @@
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition
+
+logger = logging.getLogger("uvicorn")
+
+
+class PooledSession:
+    def __init__(self, session, extra: bool):
+        self.session = session
+        # Extra sessions exceed the pool size and are closed when returned
+        self.extra = extra
+        self.last_used = time.monotonic()
+
+
+class SessionPool:
+    """
+    Bounded pool of reusable sessions, e.g. Daqbuf sources of one backend.
+
+    Borrowers wait up to timeout seconds for a session while max_size are borrowed. Sessions failing the health
+    check, or borrowed by code that raised, are closed instead of reused. Sessions idle for idle_seconds are
+    closed as well, the next time the pool is used. Code already holding a session of the pool borrows with
+    wait=False, getting one of up to max_extra extra sessions if none is left, so nested borrowing doesn't
+    deadlock the pool. At most max_size + max_extra sessions exist at any time.
+
+    Sessions are closed outside of the lock, as closing may block.
+    """
+
+    def __init__(
+        self,
+        factory,
+        max_size: int,
+        idle_seconds: float,
+        timeout: float,
+        healthy=None,
+        reset=None,
+        max_extra: int = 0,
+    ):
+        self._factory = factory
+        self._healthy = healthy or (lambda session: True)
+        self._reset = reset or (lambda session: None)
+        self.max_size = max_size
+        self.max_extra = max_extra
+        self.idle_seconds = idle_seconds
+        self.timeout = timeout
+        self._condition = Condition()
+        # Most recently returned last
+        self._idle = deque()
+        # Pooled sessions, idle or borrowed
+        self._size = 0
+        self._borrowed = 0
+        # Extra sessions currently borrowed
+        self._extra_borrowed = 0
+        self.peak_borrowed = 0
+        self.borrows = 0
+        self.created = 0
+        self.extra = 0
+        self.evicted = 0
+        self.discarded = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @contextmanager
+    def session(self, wait: bool = True):
+        pooled = self.borrow(wait)
+        try:
+            yield pooled.session
+        except BaseException:
+            self.give_back(pooled, reusable=False)
+            raise
+        self.give_back(pooled)
+
+    def borrow(self, wait: bool = True) -> PooledSession:
+        start = time.monotonic()
+        closing = []
+        try:
+            with self._condition:
+                while True:
+                    pooled = self._take_idle(closing)
+                    if pooled is not None or self._size < self.max_size:
+                        extra = False
+                        break
+                    if not wait and self._extra_borrowed < self.max_extra:
+                        extra = True
+                        break
+                    remaining = self.timeout - (time.monotonic() - start)
+                    if remaining <= 0 or not self._condition.wait(remaining):
+                        self.timeouts += 1
+                        raise TimeoutError("No session available in time")
+                waited = time.monotonic() - start
+                self.borrows += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+                if extra:
+                    self.extra += 1
+                    self._extra_borrowed += 1
+                else:
+                    self._borrowed += 1
+                    self.peak_borrowed = max(self.peak_borrowed, self._borrowed)
+                    if pooled is None:
+                        self._size += 1
+        finally:
+            self._close_all(closing)
+        if pooled is not None:
+            return pooled
+
+        try:
+            session = self._factory()
+        except BaseException:
+            self._release_slot(extra)
+            raise
+        with self._condition:
+            self.created += 1
+        return PooledSession(session, extra)
+
+    def give_back(self, pooled: PooledSession, reusable: bool = True):
+        if reusable and not pooled.extra:
+            try:
+                self._reset(pooled.session)
+            except Exception:
+                reusable = False
+        if not reusable or pooled.extra:
+            try:
+                self._close_all([pooled.session])
+            finally:
+                if not pooled.extra:
+                    with self._condition:
+                        self.discarded += 1
+                self._release_slot(pooled.extra)
+            return
+        closing = []
+        with self._condition:
+            pooled.last_used = time.monotonic()
+            self._borrowed -= 1
+            self._idle.append(pooled)
+            self._evict_idle(closing)
+            self._condition.notify()
+        self._close_all(closing)
+
+    def _evict_idle(self, closing: list):
+        """Removes the sessions idle for too long, adding them to the sessions to close once the lock is released."""
+        now = time.monotonic()
+        while self._idle and now - self._idle[0].last_used > self.idle_seconds:
+            closing.append(self._remove(self._idle.popleft()))
+            self.evicted += 1
+
+    def _take_idle(self, closing: list) -> PooledSession | None:
+        """Takes the most recently used healthy idle session, removing those idle for too long or unhealthy."""
+        self._evict_idle(closing)
+        while self._idle:
+            pooled = self._idle.pop()
+            if self._healthy(pooled.session):
+                return pooled
+            closing.append(self._remove(pooled))
+            self.discarded += 1
+        return None
+
+    def _remove(self, pooled: PooledSession):
+        self._size -= 1
+        return pooled.session
+
+    def _release_slot(self, extra: bool):
+        with self._condition:
+            if extra:
+                self._extra_borrowed -= 1
+            else:
+                self._size -= 1
+                self._borrowed -= 1
+            self._condition.notify()
+
+    def _close_all(self, sessions: list):
+        for session in sessions:
+            try:
+                self._close(session)
+            except Exception as e:
+                logger.error(f"Error closing pooled session: {e}")
+
+    @staticmethod
+    def _close(session):
+        close = getattr(session, "close", None)
+        if close is not None:
+            close()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "borrowed": self._borrowed,
+                "extra_borrowed": self._extra_borrowed,
+                "max_size": self.max_size,
+                "max_extra": self.max_extra,
+                "utilization": self._borrowed / self.max_size if self.max_size else 0,
+                "peak_borrowed": self.peak_borrowed,
+                "borrows": self.borrows,
+                "created": self.created,
+                "extra": self.extra,
+                "evicted": self.evicted,
+                "discarded": self.discarded,
+                "timeouts": self.timeouts,
+                "avg_wait_seconds": self.wait_seconds / self.borrows if self.borrows else 0,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
@@ -0,0 +1,51 @@
+from concurrent.futures import Future
+from threading import Lock
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution, whose result all callers get.
+
+    The first caller of a key runs the function, callers arriving while it runs wait for its result or
+    exception instead. Once done, the next call of the key runs the function again.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        # Key => Future of the running call
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return call.result()
+
+        try:
+            result = func()
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self) -> dict:
+        requests = self.executions + self.coalesced
+        return {
+            "in_flight": len(self._calls),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            # Average number of requests served per execution
+            "fan_in": requests / self.executions if self.executions else 0,
+        }
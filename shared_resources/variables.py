@@ -1,8 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 from os import getenv
 from threading import Lock
 
 from pymongo import MongoClient
 
+from shared_resources.channel_catalog import ChannelCatalog
+from shared_resources.curve_cache import CurveCache
+from shared_resources.live_updates import LiveHub
+from shared_resources.single_flight import SingleFlight
+
 
 class SharedState:
     def __init__(self):
@@ -14,10 +20,68 @@ class SharedState:
         self.recent_channels = []
         self.recent_channels_lock = Lock()
 
-        # Channels available on backend and therefore to be used to answer channel searches
-        self.available_backend_channels = []
-        self.available_backend_channels_lock = Lock()
+        # Channels available on backend and therefore to be used to answer channel searches.
+        # Reading needs no lock, the lock only serializes appending to or replacing the catalog.
+        self.channel_catalog = ChannelCatalog()
+        self.channel_catalog_lock = Lock()
+
+        # Memoized catalog search results, see search_catalog()
+        self.search_result_cache = {
+            "catalog": None,
+            "version": None,
+            # (search text, backend, catalog version) => matching rows, least recently used first
+            "entries": {},
+            "rows": 0,
+            "hits": 0,
+            "refined": 0,
+            "misses": 0,
+        }
+        self.search_result_cache_lock = Lock()
+
+        # Encoded response to a search for all channels, see get_catalog_response()
+        self.catalog_response = None
+        self.catalog_response_lock = Lock()
+
+        # Channel name => (exists, expiry as time.monotonic()), for channels validated against the backend
+        self.channel_existence_cache = {}
+        self.channel_existence_cache_lock = Lock()
+
+        # Curve results by request parameters, see get_curve_data()
+        self.curve_cache = CurveCache(int(getenv("CURVE_CACHE_MAX_BYTES", 512 * 1024 * 1024)))
+
+        # Curve fetches in progress, by the same key as the curve cache
+        self.curve_flights = SingleFlight()
+
+        # (namespace, backend, channel) => raw events of the last window touching the present, see request_live_tail()
+        self.live_tail_cache = CurveCache(int(getenv("LIVE_TAIL_CACHE_MAX_BYTES", 256 * 1024 * 1024)))
+
+        # (backend, channel, begin) => raw events of a whole settled part of a split request, see request_raw_segment()
+        self.raw_segment_cache = CurveCache(int(getenv("RAW_SEGMENT_CACHE_MAX_BYTES", 256 * 1024 * 1024)))
+        # Threads fetching the parts of split requests, shared by all requests, see request_raw_segments()
+        self.raw_segment_executor = ThreadPoolExecutor(
+            max_workers=int(getenv("RAW_SEGMENT_WORKERS", 4)), thread_name_prefix="raw-segment"
+        )
+        # Threads fetching and transforming batched curves, shared by all requests, see get_curves()
+        self.curve_batch_executor = ThreadPoolExecutor(
+            max_workers=int(getenv("CURVE_BATCH_WORKERS", 8)), thread_name_prefix="curve-batch"
+        )
+
+        # Backend => SessionPool of Daqbuf sources, see daqbuf_session()
+        self.daqbuf_pools = {}
+        self.daqbuf_pools_lock = Lock()
+
+        # Channels polled for live subscribers, see live_route()
+        self.live_hub = LiveHub()
+
+        # (backend, channel) => (events per second, waveform, expiry as time.monotonic()), see plan_curve_fetch()
+        self.event_rate_cache = {}
+        # Number of curve fetches by the reason of their raw or binned plan, guarded by the same lock
+        self.curve_plan_stats = {}
+        self.event_rate_cache_lock = Lock()
 
-        self.backend_sync_active = False
+        # Serializes synchronization rounds, backends within a round are synchronized in parallel
+        self.backend_sync_lock = Lock()
+        # Backend name => statistics of its last channel synchronization
+        self.backend_sync_stats = {}
 
         self.DATA_API_BASE_URL = getenv("DAQBUF_DEFAULT_URL", "https://data-api.psi.ch/api/4")
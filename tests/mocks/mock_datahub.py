@@ -39,17 +39,52 @@ class Enum:
         return f"{self.id}:{self.desc}"
 
 
-class Table:
+class Consumer:
+    def __init__(self, **kwargs):
+        pass
+
+    def on_channel_header(self, source, name, typ, byteOrder, shape, channel_compression, metadata):
+        pass
+
+    def on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs):
+        pass
+
+    def on_stop(self, source, exception):
+        pass
+
+    def on_close(self):
+        pass
+
+    def close(self):
+        self.on_close()
+
+
+class Table(Consumer):
     def __init__(self):
         self.data = {}
 
     def clear(self):
         self.data = {}
 
+    def on_channel_header(self, source, name, typ, byteOrder, shape, channel_compression, metadata):
+        self.data[name] = []
+        if metadata.get("bins", None):
+            for col in "max", "min", "count":
+                self.data[f"{name} {col}"] = []
+
+    def on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs):
+        self.data[name].append({"timestamp": timestamp, "pulse_id": pulse_id, name: value})
+        if kwargs.get("bins", None):
+            for col in "max", "min", "count":
+                self.data[f"{name} {col}"].append(
+                    {"timestamp": timestamp, "pulse_id": pulse_id, f"{name} {col}": kwargs[col]}
+                )
+
 
 class Daqbuf:
     def __init__(self, backend=None, parallel=False):
         self.listener = None
+        self.verbose = False
 
     def __enter__(self):
         return self
@@ -57,6 +92,9 @@ class Daqbuf:
     def __exit__(self, exc_type, exc_val, exc_tb):
         pass
 
+    def get_backends(self):
+        return sorted({channel["backend"] for channel in MOCK_CHANNELS["channels"]})
+
     def search(self, regex=None, case_sensitive=False):
         flags = 0 if case_sensitive else re.IGNORECASE
         pattern = re.compile(regex, flags)
@@ -69,11 +107,42 @@ class Daqbuf:
         self.listener = None
 
     def request(self, query, background=False):
-        bins = "bins" in query
-        channel = query["channels"][0]
+        # Replays the data like Daqbuf, as records per channel, with min, max and count if binned
+        bins = query.get("bins")
+        for channel in query["channels"]:
+            data = self.channel_data(channel, bins)
+            metadata = {"bins": bins} if bins else {}
+            self.listener.on_channel_header(self, channel, "float64", "little", [], None, metadata)
+            for index, record in enumerate(data[channel]):
+                kwargs = {}
+                if bins:
+                    kwargs = {
+                        col: data[f"{channel} {col}"][index][f"{channel} {col}"] for col in ("max", "min", "count")
+                    }
+                    kwargs["bins"] = bins
+                self.listener.on_channel_record(
+                    self, channel, record["timestamp"], record["pulse_id"], record[channel], **kwargs
+                )
+        self.listener.on_stop(self, None)
+
+    def abort(self):
+        pass
+
+    def is_running(self):
+        return False
+
+    def is_thread_running(self):
+        return False
+
+    def close_channels(self):
+        pass
+
+    def close(self):
+        self.listener = None
 
+    def channel_data(self, channel, bins):
         if bins:
-            self.listener.data = {
+            return {
                 channel: [
                     {
                         "timestamp": 1747406011275000064,
@@ -144,7 +213,7 @@ class Daqbuf:
                 ],
             }
         else:
-            self.listener.data = {
+            return {
                 channel: [
                     {
                         "timestamp": 1747406011306952345,
@@ -1,5 +1,20 @@
+import time
+
+import cbor2
+import numpy as np
+import pytest
 from mocks.mock_datahub import MOCK_CHANNELS
 
+CURVE_PARAMS = {"channel_name": "test-channel-1", "begin_time": 1, "end_time": 2}
+
+
+def decode_typed_arrays(decoder, tag):
+    # Little-endian typed arrays of RFC 8746
+    dtypes = {78: "<i4", 79: "<i8", 86: "<f8"}
+    if tag.tag in dtypes:
+        return np.frombuffer(tag.value, dtype=dtypes[tag.tag]).tolist()
+    return tag
+
 
 def test_channels_search_all(client):
     response = client.get("/channels/search", params={"search_text": ".*", "allow_cached_response": False})
@@ -30,6 +45,120 @@ def test_channels_search_matching_single(client):
     assert response.json() == expected
 
 
+def test_channels_search_cached(client):
+    from shared_resources.datahub_synchronizer import cache_backend_channels
+
+    cache_backend_channels(client.app.state.shared)
+
+    # Short search texts are answered from the cache
+    response = client.get("/channels/search", params={"search_text": "-2$"})
+    assert response.status_code == 200
+    assert response.json() == {"channels": [MOCK_CHANNELS["channels"][1]]}
+
+    response = client.get("/channels/search", params={"search_text": "TEST"})
+    assert response.status_code == 200
+    assert response.json() == MOCK_CHANNELS
+
+
+def test_channels_search_full_catalog_etag(client):
+    from shared_resources.datahub_synchronizer import cache_backend_channels
+
+    shared = client.app.state.shared
+    cache_backend_channels(shared)
+
+    response = client.get("/channels/search")
+    assert response.status_code == 200
+    assert response.json() == MOCK_CHANNELS
+    etag = response.headers["etag"]
+
+    response = client.get("/channels/search", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = client.get("/channels/search", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == MOCK_CHANNELS
+
+    # Refused with q=0, explicitly or through *
+    for accept_encoding in ("gzip;q=0, deflate", "deflate, *;q=0", "identity"):
+        response = client.get("/channels/search", headers={"Accept-Encoding": accept_encoding})
+        assert "content-encoding" not in response.headers
+        assert response.json() == MOCK_CHANNELS
+
+    new_channel = {**MOCK_CHANNELS["channels"][0], "name": "test-channel-3", "seriesId": "9012"}
+    with shared.channel_catalog_lock:
+        shared.channel_catalog.merge([new_channel])
+    response = client.get("/channels/search", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()["channels"][-1] == new_channel
+
+
+def test_channels_search_ranked_pages(client):
+    shared = client.app.state.shared
+    names = ["a-temp-b", "temp-1", "xx-temp", "temp"]
+    with shared.channel_catalog_lock:
+        shared.channel_catalog.merge(
+            {**MOCK_CHANNELS["channels"][0], "name": name, "seriesId": str(i)} for i, name in enumerate(names)
+        )
+
+    response = client.get("/channels/search", params={"search_text": "temp", "limit": 3})
+    assert response.status_code == 200
+    page = response.json()
+    assert [channel["name"] for channel in page["channels"]] == ["temp", "temp-1", "xx-temp"]
+
+    response = client.get("/channels/search", params={"search_text": "temp", "limit": 3, "cursor": page["next_cursor"]})
+    page = response.json()
+    assert [channel["name"] for channel in page["channels"]] == ["a-temp-b"]
+    assert page["next_cursor"] is None
+
+    response = client.get("/channels/search", params={"search_text": "temp", "limit": 3, "cursor": "invalid"})
+    assert response.status_code == 400
+
+
+def test_channels_search_memoized(client):
+    from shared_resources.datahub_synchronizer import cache_backend_channels
+
+    shared = client.app.state.shared
+    cache_backend_channels(shared)
+
+    for search_text in ["-", "-"]:
+        response = client.get("/channels/search", params={"search_text": search_text})
+        assert response.status_code == 200
+        assert response.json() == MOCK_CHANNELS
+
+    # Both extend the cached "-" and "-2", so only those results are filtered
+    for search_text in ["-2", "-2$"]:
+        response = client.get("/channels/search", params={"search_text": search_text})
+        assert response.json() == {"channels": [MOCK_CHANNELS["channels"][1]]}
+
+    stats = client.get("/maintenance/channels/stats").json()["search_cache"]
+    assert (stats["misses"], stats["hits"], stats["refined"]) == (1, 1, 2)
+
+    # Changes to the catalog invalidate the memoized results
+    new_channel = {**MOCK_CHANNELS["channels"][0], "name": "test-channel-3", "seriesId": "9012"}
+    with shared.channel_catalog_lock:
+        shared.channel_catalog.merge([new_channel])
+    response = client.get("/channels/search", params={"search_text": "-"})
+    assert response.json()["channels"][-1] == new_channel
+
+
+def test_channels_search_cache_miss(client):
+    from shared_resources.channel_catalog import ChannelCatalog
+
+    shared = client.app.state.shared
+    shared.channel_catalog = ChannelCatalog(MOCK_CHANNELS["channels"][:1])
+
+    for _ in range(2):
+        response = client.get("/channels/search", params={"search_text": "-2"})
+        assert response.status_code == 200
+        assert response.json() == {"channels": [MOCK_CHANNELS["channels"][1]]}
+
+    # The backend result is merged into the cache exactly once
+    assert shared.channel_catalog.to_dicts() == MOCK_CHANNELS["channels"]
+    assert shared.channel_catalog.merge(MOCK_CHANNELS["channels"]) == []
+
+
 def test_channels_recent(client):
     # Make the channel be registered as an available channel
     response = client.get("/channels/search", params={"search_text": "test-channel-1"})
@@ -59,6 +188,60 @@ def test_channels_recent(client):
     assert expected_channel in response.json()["channels"]
 
 
+def test_channels_recent_by_series_id(client):
+    from shared_resources.datahub_synchronizer import cache_backend_channels
+
+    shared = client.app.state.shared
+    cache_backend_channels(shared)
+    shared.recent_channels = []
+
+    response = client.get(
+        "/channels/curve",
+        params={"channel_name": "5678", "backend": "test-backend", "begin_time": 1, "end_time": 2},
+    )
+    assert response.status_code == 200
+
+    response = client.get("/channels/recent")
+    assert response.status_code == 200
+    assert response.json()["channels"] == [MOCK_CHANNELS["channels"][1]]
+
+
+def test_curve_data_non_ascii_digits(client):
+    from shared_resources.channel_catalog import is_numeric_series_id
+    from shared_resources.datahub_synchronizer import cache_backend_channels
+
+    shared = client.app.state.shared
+    cache_backend_channels(shared)
+    assert not is_numeric_series_id("²")
+    assert shared.channel_catalog.find_by_series_id("²") is None
+
+    response = client.get("/channels/curve", params={**CURVE_PARAMS, "channel_name": "²"})
+    assert response.status_code == 200
+
+
+def test_curve_data_unknown_channel(client, monkeypatch):
+    from shared_resources import channel_service
+
+    searches = []
+    original_search_channels = channel_service.search_channels
+
+    def counting_search_channels(shared, search_text, *args, **kwargs):
+        searches.append(search_text)
+        return original_search_channels(shared, search_text, *args, **kwargs)
+
+    monkeypatch.setattr(channel_service, "search_channels", counting_search_channels)
+
+    for _ in range(2):
+        response = client.get(
+            "/channels/curve",
+            params={"channel_name": "unknown-channel", "begin_time": 1, "end_time": 2},
+        )
+        assert response.status_code == 404
+
+    # The second request is answered from the existence cache
+    assert searches == ["unknown-channel"]
+
+
 def test_curve_data_raw(client):
     response = client.get(
         "/channels/curve",
@@ -156,6 +339,563 @@ def test_curve_data_binned(client):
     assert response.json() == expected
 
 
+def test_curve_data_columnar(client):
+    response = client.get(
+        "/channels/curve",
+        params={"channel_name": "test-channel-1", "begin_time": 1, "end_time": 2, "format": "columnar"},
+    )
+    assert response.status_code == 200
+    curve = response.json()["curve"]
+    default_curve = client.get(
+        "/channels/curve",
+        params={"channel_name": "test-channel-1", "begin_time": 1, "end_time": 2},
+    ).json()["curve"]
+    assert curve["test-channel-1"] == {
+        "timestamps": list(default_curve["test-channel-1"]),
+        "values": list(default_curve["test-channel-1"].values()),
+        "pulseId": [meta["pulseId"] for meta in default_curve["test-channel-1_meta"]["pointMeta"].values()],
+    }
+    assert curve["test-channel-1_meta"]["format"] == "columnar"
+
+    response = client.get(
+        "/channels/curve",
+        params={"channel_name": "test-channel-1", "begin_time": 1, "end_time": 2, "num_bins": 3, "format": "columnar"},
+    )
+    assert response.status_code == 200
+    curve = response.json()["curve"]["test-channel-1"]
+    assert curve["timestamps"] == ["1747406011275000064", "1747406011324999936", "1747406011375000064"]
+    assert curve["min"] == [200.06227, 200.27147, 200.43915]
+    assert curve["max"] == [200.69548, 201.03015, 200.7426]
+    assert curve["count"] == [5, 5, 5]
+
+    response = client.get(
+        "/channels/curve",
+        params={"channel_name": "test-channel-1", "begin_time": 1, "end_time": 2, "format": "rows"},
+    )
+    assert response.status_code == 400
+
+
+def test_curve_data_cbor(client):
+    expected = client.get("/channels/curve", params={**CURVE_PARAMS, "format": "columnar"}).json()["curve"]
+
+    response = client.get(
+        "/channels/curve",
+        params={**CURVE_PARAMS, "format": "columnar"},
+        headers={"Accept": "application/cbor"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/cbor"
+    curve = cbor2.loads(response.content, tag_hook=decode_typed_arrays)["curve"]
+    assert [str(timestamp) for timestamp in curve["test-channel-1"]["timestamps"]] == expected["test-channel-1"][
+        "timestamps"
+    ]
+    assert curve["test-channel-1"]["values"] == expected["test-channel-1"]["values"]
+    assert curve["test-channel-1"]["pulseId"] == expected["test-channel-1"]["pulseId"]
+    assert curve["test-channel-1_meta"] == expected["test-channel-1_meta"]
+
+    response = client.get("/channels/curve", params=CURVE_PARAMS, headers={"Accept": "application/cbor"})
+    assert response.status_code == 200
+    assert cbor2.loads(response.content) == client.get("/channels/curve", params=CURVE_PARAMS).json()
+
+    response = client.get("/channels/curve", params=CURVE_PARAMS, headers={"Accept": "text/html"})
+    assert response.status_code == 406
+
+
+def test_curve_data_arrow(client):
+    pyarrow = pytest.importorskip("pyarrow")
+
+    response = client.get(
+        "/channels/curve",
+        params={**CURVE_PARAMS, "num_bins": 3},
+        headers={"Accept": "application/vnd.apache.arrow.stream"},
+    )
+    assert response.status_code == 200
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+    assert table.column("timestamp").to_pylist() == [1747406011275000064, 1747406011324999936, 1747406011375000064]
+    assert table.column("count").to_pylist() == [5, 5, 5]
+    assert table.schema.metadata[b"channel"] == b"test-channel-1"
+
+
+def test_curve_data_arrow_unavailable(client, monkeypatch):
+    import shared_resources.curve_encoding
+
+    monkeypatch.setattr(shared_resources.curve_encoding, "pyarrow", None)
+    response = client.get(
+        "/channels/curve", params=CURVE_PARAMS, headers={"Accept": "application/vnd.apache.arrow.stream"}
+    )
+    assert response.status_code == 406
+
+    # Clients accepting other formats as well get one of those
+    response = client.get(
+        "/channels/curve",
+        params=CURVE_PARAMS,
+        headers={"Accept": "application/vnd.apache.arrow.stream, application/json;q=0.5"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/json")
+
+
+def test_curve_encoding_size(client, record_property):
+    from shared_resources import curve_encoding
+    from shared_resources.channel_service import transform_curve_data_columnar
+    from shared_resources.curve_encoding import encode_arrow, encode_cbor, encode_json
+
+    events = 100_000
+    daqbuf_data = {
+        "channel": [
+            {"timestamp": 1747406011306952345 + i * 10_000_000, "pulse_id": 24244952345 + i, "channel": i * 0.37}
+            for i in range(events)
+        ]
+    }
+    result = transform_curve_data_columnar(daqbuf_data, "channel")
+
+    encoders = {"json": encode_json, "cbor": encode_cbor}
+    if curve_encoding.pyarrow is not None:
+        encoders["arrow"] = encode_arrow
+    sizes, seconds = {}, {}
+    for name, encode in encoders.items():
+        start = time.perf_counter()
+        sizes[name] = len(encode(result))
+        seconds[name] = time.perf_counter() - start
+    # Reported in the JUnit XML report for comparison, not asserted on as it depends on the machine
+    record_property("encoding_bytes", sizes)
+    record_property("encoding_seconds", seconds)
+
+    # Three typed arrays of 8 bytes per event, plus a few bytes of framing and meta
+    assert sizes["cbor"] < events * 3 * 8 + 1000
+    assert sizes["cbor"] < sizes["json"] * 0.7
+
+
+def test_curve_waveform_columnar(client):
+    from shared_resources.channel_service import transform_curve_data_columnar
+    from shared_resources.curve_encoding import encode_cbor
+
+    daqbuf_data = {
+        "channel": [
+            {"timestamp": 1747406011306952345 + i, "pulse_id": 24244952345 + i, "channel": np.arange(4.0) + i}
+            for i in range(3)
+        ]
+    }
+    result = transform_curve_data_columnar(daqbuf_data, "channel")
+    curve = result["curve"]["channel"]
+    assert curve["values"].shape == (3, 4)
+    assert curve["values"][2].tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert curve["pulseId"].tolist() == [24244952345, 24244952346, 24244952347]
+    assert result["curve"]["channel_meta"]["waveform"]
+
+    # Sent as one RFC 8746 multi-dimensional array
+    dimensions, values = cbor2.loads(encode_cbor(result))["curve"]["channel"]["values"].value
+    assert list(dimensions) == [3, 4]
+    assert np.frombuffer(values.value, dtype="<f8").tolist() == curve["values"].ravel().tolist()
+
+    # Waveforms of different lengths are padded
+    daqbuf_data["channel"][0]["channel"] = np.arange(2.0)
+    curve = transform_curve_data_columnar(daqbuf_data, "channel")["curve"]["channel"]
+    assert curve["lengths"].tolist() == [2, 4, 4]
+    assert np.isnan(curve["values"][0, 2:]).all()
+
+
+def test_curve_data_cached(client):
+    shared = client.app.state.shared
+    for _ in range(2):
+        response = client.get("/channels/curve", params=CURVE_PARAMS)
+        assert response.status_code == 200
+        assert len(response.json()["curve"]["test-channel-1"]) == 6
+
+    stats = client.get("/maintenance/channels/stats").json()["curve_cache"]
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    assert 0 < stats["bytes"] <= stats["max_bytes"]
+
+    # Least recently used curves are evicted once the budget is exceeded
+    shared.curve_cache.max_bytes = stats["bytes"] * 3 // 2
+    client.get("/channels/curve", params={**CURVE_PARAMS, "num_bins": 3})
+    assert shared.curve_cache.stats()["evictions"] == 1
+    assert len(shared.curve_cache) == 1
+
+
+def test_curve_data_live_tail(client, monkeypatch):
+    from shared_resources import channel_service
+
+    # Live curves are then neither cached nor aligned, so each refresh goes to the live tail
+    monkeypatch.setattr(channel_service, "CURVE_CACHE_LIVE_TTL_SECONDS", 0)
+    shared = client.app.state.shared
+    now = int(time.time() * 1000)
+    params = {"channel_name": "test-channel-1", "begin_time": 1747406011000, "end_time": now + 60_000}
+    expected = client.get("/channels/curve", params=params).json()
+    assert len(expected["curve"]["test-channel-1"]) == 6
+
+    # The next refresh only fetches what is new, which the mock returns as the same old events again
+    response = client.get("/channels/curve", params={**params, "begin_time": params["begin_time"] + 1})
+    assert response.status_code == 200
+    assert response.json() == expected
+    assert shared.live_tail_cache.stats()["hits"] == 1
+
+    # Events before the window are dropped
+    response = client.get("/channels/curve", params={**params, "begin_time": 1747406011330})
+    assert list(response.json()["curve"]["test-channel-1"]) == list(expected["curve"]["test-channel-1"])[3:]
+
+
+def test_live_events_without_live_tail(client, monkeypatch):
+    from shared_resources import channel_service
+
+    # A negative overlap disables the live tail, each poll fetches its whole window
+    monkeypatch.setattr(channel_service, "LIVE_TAIL_OVERLAP_SECONDS", -10)
+    shared = client.app.state.shared
+    now = int(time.time() * 1000)
+    for begin_time in (1747406011000, 1747406011001):
+        events = channel_service.fetch_live_events(shared, "test-backend", "test-channel-1", begin_time, now + 60_000)
+        assert len(events) == 6
+    assert shared.live_tail_cache.get(("live_updates", "test-backend", "test-channel-1")) is None
+
+
+def test_curve_data_live_aligned(client):
+    shared = client.app.state.shared
+    step = 5000
+    now = int(time.time() * 1000)
+    end_time = now - now % step - step
+    params = {"channel_name": "test-channel-1", "num_bins": 3}
+
+    # Refreshes of the last hour made within the same few seconds
+    for offset in (1, 2, 3):
+        response = client.get(
+            "/channels/curve",
+            params={**params, "begin_time": end_time + offset - 3_600_000, "end_time": end_time + offset},
+        )
+        assert response.status_code == 200
+
+    stats = shared.curve_cache.stats()
+    assert (stats["misses"], stats["hits"]) == (1, 2)
+
+
+def test_curve_data_coalesced(client, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from threading import Barrier
+
+    from shared_resources import channel_service
+
+    shared = client.app.state.shared
+    requests = 5
+    arrived = Barrier(requests + 1)
+    fetches = []
+
+    def slow_fetch_curve_data(*args, **kwargs):
+        fetches.append(args)
+        # Wait until all requests wait for this fetch
+        while shared.curve_flights.stats()["coalesced"] < requests - 1:
+            time.sleep(0.01)
+        return {"curve": {}}
+
+    monkeypatch.setattr(channel_service, "fetch_curve_data", slow_fetch_curve_data)
+
+    def request(_):
+        arrived.wait()
+        return channel_service.get_curve_data(shared, "test-channel-1", 1, 2, "test-backend", 0, False, False, None)
+
+    with ThreadPoolExecutor(max_workers=requests) as executor:
+        results = executor.map(request, range(requests))
+        arrived.wait()
+        results = list(results)
+
+    assert len(fetches) == 1
+    assert all(result is results[0] for result in results)
+    stats = client.get("/maintenance/channels/stats").json()["curve_fetches"]
+    assert (stats["executions"], stats["coalesced"], stats["fan_in"]) == (1, requests - 1, requests)
+
+
+def test_curve_data_plan(client):
+    params = {**CURVE_PARAMS, "num_bins": 100, "useEventsIfBinCountTooLarge": True}
+    # Unknown event rates are probed, the mock has 15 events, so raw events are fetched
+    response = client.get("/channels/curve", params=params)
+    assert response.json()["curve"]["test-channel-1_meta"]["plan"] == {"raw": True, "reason": "probe", "events": 15}
+    assert len(response.json()["curve"]["test-channel-1"]) == 6
+
+    # Later requests plan by the event rate, here of the 6 raw events fetched, without probing again
+    response = client.get("/channels/curve", params={**params, "end_time": 3})
+    plan = {"raw": True, "reason": "event_rate", "estimated_events": 12}
+    assert response.json()["curve"]["test-channel-1_meta"]["plan"] == plan
+    response = client.get("/channels/curve", params={**params, "end_time": 3, "num_bins": 2})
+    plan = {"raw": False, "reason": "event_rate", "estimated_events": 6}
+    assert response.json()["curve"]["test-channel-1_meta"]["plan"] == plan
+    assert len(response.json()["curve"]["test-channel-1"]) == 3
+
+    stats = client.get("/maintenance/channels/stats").json()["curve_plans"]
+    assert stats == {"event_rates": 1, "reasons": {"probe": 1, "event_rate": 2}}
+
+
+def test_curve_data_downsampled(client):
+    # M4 keeps the first, last, minimum and maximum of the 6 raw events of the mock
+    response = client.get("/channels/curve", params={**CURVE_PARAMS, "max_points": 4})
+    assert response.status_code == 200
+    curve = response.json()["curve"]
+    assert curve["test-channel-1_meta"]["downsampled"] == {"method": "m4", "events": 6, "points": 4}
+    assert list(curve["test-channel-1"].values()) == [
+        200.88821411132812,
+        200.27146911621094,
+        201.0301513671875,
+        200.7425994873047,
+    ]
+
+    response = client.get("/channels/curve", params={**CURVE_PARAMS, "max_points": 4, "downsampling": "lttb"})
+    curve = response.json()["curve"]
+    assert curve["test-channel-1_meta"]["downsampled"] == {"method": "lttb", "events": 6, "points": 4}
+    assert len(curve["test-channel-1"]) == 4
+
+    response = client.get("/channels/curve", params={**CURVE_PARAMS, "max_points": 6})
+    assert "downsampled" not in response.json()["curve"]["test-channel-1_meta"]
+    assert len(response.json()["curve"]["test-channel-1"]) == 6
+
+    assert client.get("/channels/curve", params={**CURVE_PARAMS, "max_points": 3}).status_code == 400
+    assert client.get("/channels/curve", params={**CURVE_PARAMS, "downsampling": "every-nth"}).status_code == 400
+
+
+def test_curve_data_streamed(client, monkeypatch):
+    import io
+
+    import orjson
+
+    from shared_resources import channel_service
+
+    expected = client.get("/channels/curve", params=CURVE_PARAMS).json()
+    response = client.get("/channels/curve", params={**CURVE_PARAMS, "stream": True})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [orjson.loads(line) for line in response.content.splitlines()] == [expected]
+
+    # Each chunk is a curve of its own
+    monkeypatch.setattr(channel_service, "CURVE_STREAM_CHUNK_SIZE", 4)
+    response = client.get("/channels/curve", params={**CURVE_PARAMS, "stream": True})
+    chunks = [orjson.loads(line)["curve"]["test-channel-1"] for line in response.content.splitlines()]
+    assert [len(chunk) for chunk in chunks] == [4, 2]
+    assert {**chunks[0], **chunks[1]} == expected["curve"]["test-channel-1"]
+
+    response = client.get(
+        "/channels/curve", params={**CURVE_PARAMS, "stream": True}, headers={"Accept": "application/cbor"}
+    )
+    assert response.headers["content-type"] == "application/cbor-seq"
+    stream = io.BytesIO(response.content)
+    decoder = cbor2.CBORDecoder(stream)
+    frames = []
+    while stream.tell() < len(response.content):
+        frames.append(decoder.decode())
+    assert [len(frame["curve"]["test-channel-1"]) for frame in frames] == [4, 2]
+
+    params = {**CURVE_PARAMS, "stream": True, "max_points": 4}
+    assert client.get("/channels/curve", params=params).status_code == 400
+
+
+def test_curve_data_streamed_timed_out(client, monkeypatch):
+    import orjson
+
+    from routers import channels
+
+    monkeypatch.setattr(channels, "CURVE_STREAM_TIMEOUT_SECONDS", 0)
+    response = client.get("/channels/curve", params={**CURVE_PARAMS, "stream": True})
+    assert response.status_code == 200
+    assert orjson.loads(response.content.splitlines()[-1]) == {"error": "Request timed out"}
+
+
+def test_curve_data_streamed_error(client, monkeypatch):
+    import orjson
+
+    from shared_resources import channel_service
+
+    def exhausted_pool(*args, **kwargs):
+        raise TimeoutError("No session available in time")
+
+    monkeypatch.setattr(channel_service, "plan_curve_fetch", exhausted_pool)
+    response = client.get("/channels/curve", params={**CURVE_PARAMS, "stream": True})
+    assert response.status_code == 200
+    assert [orjson.loads(line) for line in response.content.splitlines()] == [
+        {"error": "Error fetching data from backend"}
+    ]
+
+
+def test_curve_data_split(client, monkeypatch):
+    from shared_resources import channel_service
+
+    expected = client.get("/channels/curve", params=CURVE_PARAMS).json()["curve"]["test-channel-1"]
+
+    # Split into parts of 10ms, the mock returns all events for each of them
+    monkeypatch.setattr(channel_service, "RAW_SEGMENT_SECONDS", 0.01)
+    params = {**CURVE_PARAMS, "begin_time": 1747406011295, "end_time": 1747406011362}
+    response = client.get("/channels/curve", params=params)
+    assert response.json()["curve"]["test-channel-1"] == expected
+    stats = client.get("/maintenance/channels/stats").json()["raw_segment_cache"]
+    assert (stats["entries"], stats["hits"]) == (6, 0)
+    # The parts borrow pooled sources, the request gave its own back before fetching them
+    pools = client.get("/maintenance/channels/stats").json()["daqbuf_pools"]
+    assert sum(pool["extra"] for pool in pools.values()) == 0
+
+    # Whole parts are reused by overlapping requests
+    response = client.get("/channels/curve", params={**params, "begin_time": 1747406011300, "end_time": 1747406011370})
+    assert response.json()["curve"]["test-channel-1"] == expected
+    stats = client.get("/maintenance/channels/stats").json()["raw_segment_cache"]
+    assert (stats["entries"], stats["hits"]) == (7, 6)
+
+    # Short ranges aren't split, even if they cross a multiple
+    assert channel_service.raw_segments(1747406011395, 1747406011402) == [(1747406011395, 1747406011402)]
+    assert channel_service.raw_segments(1747406011395, 1747406011412) == [
+        (1747406011395, 1747406011400),
+        (1747406011400, 1747406011410),
+        (1747406011410, 1747406011412),
+    ]
+
+
+def test_daqbuf_sessions_pooled(client):
+    for end_time in (2, 3, 4):
+        response = client.get(
+            "/channels/curve", params={**CURVE_PARAMS, "backend": "test-backend", "end_time": end_time}
+        )
+        assert response.status_code == 200
+
+    stats = client.get("/maintenance/channels/stats").json()["daqbuf_pools"]["test-backend"]
+    assert (stats["borrows"], stats["created"], stats["idle"], stats["borrowed"]) == (3, 1, 1, 0)
+    assert stats["utilization"] == 0
+    assert stats["peak_borrowed"] == 1
+
+
+def test_daqbuf_session_extras_bounded():
+    from shared_resources.session_pool import SessionPool
+
+    pool = SessionPool(object, 1, 300, 0.1, max_extra=1)
+    with pool.session(), pool.session(wait=False):
+        assert pool.stats()["extra_borrowed"] == 1
+        with pytest.raises(TimeoutError), pool.session(wait=False):
+            pass
+    stats = pool.stats()
+    assert (stats["size"], stats["extra_borrowed"], stats["extra"], stats["timeouts"]) == (1, 0, 1, 1)
+
+
+def test_daqbuf_session_close_error():
+    from shared_resources.session_pool import SessionPool
+
+    class FailingClose:
+        def close(self):
+            raise OSError("close failed")
+
+    pool = SessionPool(FailingClose, 1, 300, 0.1, max_extra=1)
+    # The error of the caller is kept, and the slot of the discarded session is freed
+    with pytest.raises(ValueError), pool.session():
+        raise ValueError
+    with pool.session(), pool.session(wait=False):
+        pass
+    stats = pool.stats()
+    assert (stats["size"], stats["borrowed"], stats["extra_borrowed"], stats["discarded"]) == (1, 0, 0, 1)
+
+
+def test_route_executors(client):
+    before = client.get("/maintenance/channels/stats").json()["route_executors"]
+    response = client.get("/channels/curve", params={**CURVE_PARAMS, "backend": "test-backend"})
+    assert response.status_code == 200
+    assert client.get("/channels/recent").status_code == 200
+
+    stats = client.get("/maintenance/channels/stats").json()["route_executors"]
+    for executor in ("data", "fast"):
+        assert stats[executor]["completed"] == before.get(executor, {}).get("completed", 0) + 1
+        assert (stats[executor]["queued"], stats[executor]["running"]) == (0, 0)
+    assert stats["data"]["workers"] == 32
+
+
+def test_route_stream_timed_out():
+    import asyncio
+
+    from shared_resources.cancellation import current_token
+    from shared_resources.decorators import stream
+
+    def items():
+        yield "first"
+        token = current_token.get()
+        # Blocks like a Daqbuf query until the stream is cancelled
+        while not token.cancelled:
+            time.sleep(0.01)
+        yield token.reason
+
+    async def collect():
+        return [item async for item in stream(items(), 0.1)]
+
+    assert asyncio.run(collect()) == ["first", "Request timed out"]
+
+
+def test_curve_data_batch(client):
+    import orjson
+
+    channels = ["test-channel-1", "test-channel-2", "missing-channel"]
+    body = {
+        "begin_time": 1,
+        "end_time": 2,
+        "channels": [{"channel_name": name, "backend": "test-backend"} for name in channels],
+    }
+    response = client.post("/channels/curves", json=body)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = {line["channel_name"]: line for line in map(orjson.loads, response.content.splitlines())}
+    assert sorted(lines) == sorted(channels)
+    assert lines["missing-channel"]["error"] == "Channel not found in backend"
+    for name in channels[:2]:
+        params = {**CURVE_PARAMS, "channel_name": name, "backend": "test-backend"}
+        expected = client.get("/channels/curve", params=params)
+        assert lines[name] == {"channel_name": name, "backend": "test-backend", "isString": False, **expected.json()}
+
+    response = client.post("/channels/curves", json={**body, "channels": []})
+    assert response.status_code == 400
+
+
+def test_curve_data_batch_timed_out(client, monkeypatch):
+    import orjson
+
+    from routers import channels
+
+    # The curves are only fetched once the stream is already past its deadline
+    monkeypatch.setattr(channels, "CURVE_STREAM_TIMEOUT_SECONDS", 0)
+    names = ["test-channel-1", "test-channel-2"]
+    body = {
+        "begin_time": 1,
+        "end_time": 2,
+        "channels": [{"channel_name": name, "backend": "test-backend"} for name in names],
+    }
+    response = client.post("/channels/curves", json=body)
+    assert response.status_code == 200
+    assert [line["error"] for line in map(orjson.loads, response.content.splitlines())] == ["Request timed out"] * 2
+
+    stats = client.get("/maintenance/channels/stats").json()["route_executors"]["data"]
+    assert stats["timed_out"] >= 1
+    assert (stats["streams"], stats["queued"], stats["running"]) == (0, 0, 0)
+
+
+def test_live_updates(client):
+    channels = [
+        {"channel_name": "test-channel-1", "backend": "test-backend"},
+        {"channel_name": "missing-channel", "backend": "test-backend"},
+    ]
+    with client.websocket_connect("/channels/live") as websocket:
+        websocket.send_json({"subscribe": channels})
+        assert websocket.receive_json() == {**channels[1], "isString": False, "error": "Channel not found in backend"}
+        frame = websocket.receive_json()
+        assert (frame["channel_name"], frame["backend"]) == ("test-channel-1", "test-backend")
+        assert len(frame["curve"]["test-channel-1"]) == 6
+
+        stats = client.get("/maintenance/channels/stats").json()["live_updates"]
+        assert (stats["channels"], stats["subscriptions"]) == (1, 1)
+
+        # Malformed messages are answered with an error, the socket stays open
+        for unsubscribe in ("test-channel-1", [1]):
+            websocket.send_json({"unsubscribe": unsubscribe})
+            assert websocket.receive_json() == {"error": "unsubscribe must be a list of objects with a channel_name"}
+
+    # Polls keep their own windows, apart from those of curve requests
+    shared = client.app.state.shared
+    assert shared.live_tail_cache.get(("live_updates", "test-backend", "test-channel-1")) is not None
+    assert shared.live_tail_cache.get(("curve", "test-backend", "test-channel-1")) is None
+
+    # Polling stops with the last subscriber
+    for _ in range(100):
+        if client.get("/maintenance/channels/stats").json()["live_updates"]["channels"] == 0:
+            break
+        time.sleep(0.01)
+    assert client.get("/maintenance/channels/stats").json()["live_updates"]["channels"] == 0
+
+
 def test_raw_link_success_default_base(client):
     params = {"channel_name": "test-channel", "begin_time": 10, "end_time": 20}
     resp = client.get("/channels/raw-link", params=params)
@@ -177,3 +917,54 @@ def test_raw_link_success_custom_base(client):
         "link": "https://custom-url/api/events?backend=sf-databuffer&channelName=foo&begDate=1970-01-01+00%3A00%3A00.123%2B00%3A00&endDate=1970-01-01+00%3A00%3A00.456%2B00%3A00"
     }
     assert resp.json() == expected
+
+
+def test_channel_stats(client):
+    from shared_resources.datahub_synchronizer import cache_backend_channels
+
+    cache_backend_channels(client.app.state.shared)
+
+    response = client.get("/maintenance/channels/stats")
+    assert response.status_code == 200
+    catalog = response.json()["catalog"]
+    assert catalog["rows"] == len(MOCK_CHANNELS["channels"])
+    assert catalog["catalog_bytes"] > 0
+    assert catalog["index_bytes"] > 0
+    assert catalog["list_of_dicts_bytes"] > 0
+    assert catalog["interned_values"]["backend"] == 1
+    sync = response.json()["sync"]["test-backend"]
+    assert sync["channels"] == len(MOCK_CHANNELS["channels"])
+    assert sync["error"] is None
+    assert sync["next_sync"] > sync["last_sync"]
+
+
+def test_channel_sync_applies_diff(client):
+    from shared_resources.channel_catalog import ChannelCatalog
+    from shared_resources.datahub_synchronizer import cache_backend_channels
+
+    shared = client.app.state.shared
+    stale_channel = {**MOCK_CHANNELS["channels"][0], "name": "test-channel-removed", "seriesId": "999"}
+    with shared.channel_catalog_lock:
+        shared.channel_catalog = ChannelCatalog([MOCK_CHANNELS["channels"][0], stale_channel])
+
+    cache_backend_channels(shared)
+
+    assert shared.channel_catalog.to_dicts() == MOCK_CHANNELS["channels"]
+    assert shared.channel_catalog.find("test-channel-removed") is None
+    assert shared.channel_catalog.to_dicts(shared.channel_catalog.last_rows(10)) == MOCK_CHANNELS["channels"]
+    stats = shared.backend_sync_stats["test-backend"]
+    assert (stats["added"], stats["removed"]) == (1, 1)
+
+
+def test_channel_catalog_snapshot(client):
+    from shared_resources.catalog_snapshot import load_catalog_snapshot
+    from shared_resources.datahub_synchronizer import cache_backend_channels
+
+    shared = client.app.state.shared
+    cache_backend_channels(shared)
+
+    catalog = load_catalog_snapshot(shared)
+    assert catalog is not None
+    assert catalog.to_dicts() == MOCK_CHANNELS["channels"]
+    assert catalog.find("test-channel-2").to_dict() == MOCK_CHANNELS["channels"][1]
+    assert [channel.to_dict() for channel in catalog.search("-1$")] == MOCK_CHANNELS["channels"][:1]